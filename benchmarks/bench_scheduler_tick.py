@@ -0,0 +1,94 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""Compares a scheduler tick using a full-table scan against the due index.
+
+Loads a moto-backed PollexyMessageSchedule table with mostly future
+schedules plus a fixed number of due ones, then times get_messages() in
+both modes. moto still filters the index in memory, so the numbers show the
+client-side cost (transfer, deserialization and recurrence evaluation),
+which is what dominates the queue Lambda.
+
+    PYTHONPATH=. python benchmarks/bench_scheduler_tick.py --count 100000
+"""
+import argparse
+import time
+import arrow
+from moto import mock_dynamodb2
+import boto3
+from messages.message import ScheduledMessage
+from scheduler.scheduler import Scheduler, MESSAGE_SCHEDULE_DB, \
+    convert_to_db_item
+
+
+def make_message(start_date):
+    return ScheduledMessage(
+        StartDateTimeInUtc=start_date,
+        Frequency='DAILY',
+        Body='Benchmark message',
+        PersonName='benchperson',
+        BotNames='none',
+        RequiredBots='none',
+        IceBreaker='none',
+        EndDateTimeInUtc=start_date.replace(years=1))
+
+
+def load_schedules(count, due_count):
+    table = boto3.resource('dynamodb').Table(MESSAGE_SCHEDULE_DB)
+    now = arrow.utcnow()
+    with table.batch_writer() as batch:
+        for i in range(count):
+            if i < due_count:
+                start = now.replace(minutes=-5)
+            else:
+                start = now.replace(days=+1 + i % 30)
+            batch.put_item(Item=convert_to_db_item(make_message(start)))
+
+
+def time_tick(scheduler, repeat, **kwargs):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        msgs = scheduler.get_messages(**kwargs)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(msgs)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--due', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    mock = mock_dynamodb2()
+    mock.start()
+    try:
+        scheduler = Scheduler()
+        sizes = sorted(set([min(args.count, n)
+                            for n in (1000, 10000, args.count)]))
+        loaded = 0
+        for size in sizes:
+            load_schedules(size - loaded, args.due if not loaded else 0)
+            loaded = size
+            scan, scan_n = time_tick(scheduler, args.repeat)
+            index, index_n = time_tick(scheduler, args.repeat,
+                                       UseDueIndex=True)
+            print '{:>8} schedules  scan: {:8.3f}s ({} ready)  ' \
+                  'due index: {:8.3f}s ({} ready)'.format(
+                      size, scan, scan_n, index, index_n)
+    finally:
+        mock.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -20,18 +20,41 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
-import boto3
+from multiprocessing.pool import ThreadPool
+from helpers.aws_clients import get_client_pool
+import json
 import os
 import os.path
 import logging
+import sys
+import tempfile
+import threading
+import time
+
+
+CACHE_BASE_FOLDER = os.path.expanduser("~/.pollexy/.cache")
+SYNC_TTL_SECONDS = 300
+SYNC_THREADS = 8
+MANIFEST_FILE = '.manifest.json'
+
+# when each bucket/cache pair was last synced by this process
+_last_synced = {}
+_last_synced_lock = threading.Lock()
+
+
+def forget_sync_times():
+    with _last_synced_lock:
+        _last_synced.clear()
 
 
 class CacheManager(object):
     def __init__(self, **kwargs):
         self.cache_root_folder = kwargs.get("cache_folder", "~/.pollexy/cache")
         self.bucket_name = kwargs.get("BucketName", "")
-        self.base_folder = os.path.expanduser("~/.pollexy/.cache")
+        self.base_folder = CACHE_BASE_FOLDER
         self.cache_name = kwargs.get("CacheName", "")
+        self.clients = kwargs.get("Clients") or get_client_pool()
+        self.sync_ttl = kwargs.get("SyncTtlSeconds", SYNC_TTL_SECONDS)
 
         if not self.cache_name:
             raise ValueError("No cache name provided")
@@ -43,43 +66,138 @@ class CacheManager(object):
         self.verify_cache_folder()
 
     def verify_cache_folder(self):
+        logging.debug("Verifying that %s exists" % self.local_cache_folder)
+        self.makedirs(self.local_cache_folder)
+
+    def sync_remote_folder(self, **kwargs):
+        """download new and changed files
+
+        A sync within SyncTtlSeconds of the last one in this process is
+        skipped unless Force is set. Files are compared against the ETag
+        and size recorded in the local manifest, and the stale ones are
+        downloaded in parallel. If any download fails, the ones that
+        finished are still recorded, the sync time is put back so the
+        next call tries again, and the first error is raised."""
+        key = (self.bucket_name, self.cache_name)
+        with _last_synced_lock:
+            last = _last_synced.get(key)
+            if not kwargs.get('Force') and last is not None and \
+                    time.time() - last < self.sync_ttl:
+                return
+            # claimed up front so concurrent syncs don't repeat the work
+            _last_synced[key] = time.time()
         try:
-            logging.debug("Verifying that %s exists" % self.local_cache_folder)
-            os.makedirs(self.local_cache_folder)
-        except OSError:
-            if not os.path.isdir(self.local_cache_folder):
-                raise
+            self._sync()
+        except Exception:
+            with _last_synced_lock:
+                if last is None:
+                    _last_synced.pop(key, None)
+                else:
+                    _last_synced[key] = last
+            raise
 
-    def sync_remote_folder(self):
-        client = boto3.client('s3')
-        files = self.get_remote_file_list()
-        if files:
-            logging.info("Syncing %s/%s" % (self.bucket_name,
-                                            self.cache_name))
-            for file in files:
-                if file["Key"].endswith('/'):
-                    continue
-                local_file = "%s/%s" % (self.base_folder, file["Key"])
-                logging.info(local_file)
-                if not os.path.exists(local_file):
-                    logging.info("...Syncing  %s" % local_file)
-                    print "Syncing cache: %s" % local_file
-                    client.download_file(self.bucket_name,
-                                         file["Key"],
-                                         local_file)
-        else:
+    def _sync(self):
+        files = [f for f in self.get_remote_file_list()
+                 if not f["Key"].endswith('/')]
+        if not files:
             logging.warn("No files in %s/%s" % (self.bucket_name,
                                                 self.cache_name))
+            return
+        logging.info("Syncing %s/%s" % (self.bucket_name, self.cache_name))
+        manifest = self.read_manifest()
+        stale = [f for f in files if not self.is_fresh(f, manifest)]
+        if not stale:
+            return
+        pool = ThreadPool(min(SYNC_THREADS, len(stale)))
+        try:
+            results = pool.map(self.try_download, stale)
+        finally:
+            pool.close()
+            pool.join()
+        errors = []
+        for f, exc_info in results:
+            if exc_info:
+                errors.append(exc_info)
+                continue
+            manifest[f["Key"]] = {'ETag': f["ETag"], 'Size': f["Size"]}
+        if len(errors) < len(results):
+            self.write_manifest(manifest)
+        if errors:
+            logging.error("%d of %d downloads failed in %s/%s"
+                          % (len(errors), len(results), self.bucket_name,
+                             self.cache_name))
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+    def try_download(self, f):
+        """download f, returning it and any sys.exc_info() of the failure"""
+        try:
+            return self.download(f), None
+        except Exception:
+            logging.exception("Unable to download %s" % f["Key"])
+            return f, sys.exc_info()
+
+    def local_path(self, key):
+        return "%s/%s" % (self.base_folder, key)
+
+    def is_fresh(self, f, manifest):
+        entry = manifest.get(f["Key"])
+        if not entry or entry['ETag'] != f["ETag"]:
+            return False
+        try:
+            return os.path.getsize(self.local_path(f["Key"])) == f["Size"]
+        except OSError:
+            return False
+
+    def download(self, f):
+        local_file = self.local_path(f["Key"])
+        folder = os.path.dirname(local_file)
+        if not os.path.isdir(folder):
+            self.makedirs(folder)
+        logging.info("...Syncing  %s" % local_file)
+        print "Syncing cache: %s" % local_file
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        os.close(fd)
+        try:
+            self.clients.client('s3').download_file(self.bucket_name,
+                                                    f["Key"],
+                                                    tmp_path)
+            os.rename(tmp_path, local_file)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        return f
+
+    def makedirs(self, folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            if not os.path.isdir(folder):
+                raise
+
+    def read_manifest(self):
+        try:
+            with open(os.path.join(self.local_cache_folder,
+                                   MANIFEST_FILE)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def write_manifest(self, manifest):
+        fd, tmp_path = tempfile.mkstemp(dir=self.local_cache_folder,
+                                        suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp_path, os.path.join(self.local_cache_folder,
+                                         MANIFEST_FILE))
 
     def get_remote_file_list(self):
-        client = boto3.client('s3')
-        logging.info("Syncing %s/%s" % (self.bucket_name, self.cache_name))
-        objects = client.list_objects(Bucket=self.bucket_name,
-                                      Prefix="%s/" % self.cache_name)
-        if "Contents" not in objects.keys():
-            raise StopIteration
-        for result in objects["Contents"]:
-            yield result
+        client = self.clients.client('s3')
+        logging.info("Listing %s/%s" % (self.bucket_name, self.cache_name))
+        paginator = client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name,
+                                       Prefix="%s/" % self.cache_name):
+            for result in page.get("Contents", []):
+                yield result
 
     def get_file_count(self):
         return sum(1 for _ in self.get_remote_file_list())
@@ -12,14 +12,22 @@
 
 import click
 from messages.message import ScheduledMessage
-from messages.message_manager import MessageManager, LibraryManager
+from messages.message_manager import MessageManager, LibraryManager, \
+    publish_to_locations
+from messages.polling import IDLE_BACKOFF_MAX_SECONDS
 from scheduler.scheduler import Scheduler
 from speaker.speaker import Speaker
-from cache.cache_manager import CacheManager
-from person.person import PersonManager
+from speaker.location_agent import LocationAgent
+from speaker.audio_engine import stop_audio_engine
+from speaker.location_player import QUEUE_POLL_SECONDS
+from cache.cache_manager import CacheManager, SYNC_TTL_SECONDS
+from person.person import PersonManager, PersonRepository
+from person.availability import AvailabilityMatrix
 from face.face import FaceManager
-from locator.locator import LocationManager, LocationVerification
+from locator.locator import LocationManager, LocationVerification, \
+    LocationStateCache
 from helpers.config import ConfigHelper
+from helpers.runtime import DeviceRuntime
 import random
 import arrow
 import logging
@@ -219,16 +227,31 @@ def delete_person(person_name):
 
 
 @person.command('availability')
-@click.argument('person_name')
-def person_availability(person_name):
+@click.argument('person_name', required=False)
+@click.option('--minutes', default=0,
+              help='Include locations that open within this many minutes')
+def person_availability(person_name, minutes):
     pm = PersonManager()
-    p = pm.get_person(person_name)
-    locs = p.all_available()
-    if len(locs) > 0:
-        for l in locs:
-            print l.location_name
+    if person_name:
+        p = pm.get_person(person_name)
+        people = [p] if p else []
+    else:
+        people = pm.get_all() or []
+    matrix = AvailabilityMatrix(People=people, Slots=minutes + 1)
+    if minutes:
+        reachable = matrix.reachable_within(minutes)
     else:
-        print "No locations are currently acrive"
+        reachable = matrix.reachable_at()
+    if person_name:
+        for ln in reachable.get(person_name, []):
+            print ln
+        if person_name not in reachable:
+            print "No locations are currently active"
+        return
+    if not reachable:
+        print "No one can be reached at any location"
+    for name in sorted(reachable):
+        click.echo('{}: {}'.format(name, ', '.join(reachable[name])))
 
 
 @person.command('list')
@@ -292,7 +315,7 @@ def location_list():
         click.echo("There are no locations")
     else:
         for l in locs:
-            click.echo(l.location_name['S'])
+            click.echo(l.location_name)
 
 
 @cli.group('message')
@@ -327,6 +350,18 @@ def message_delete(person_name, message_id, verbose):
                      PersonName=person_name)
 
 
+@message.command('reindex')
+@click.option('--verbose/--no-verbose', default=False)
+def message_reindex(verbose):
+    log = logging.getLogger('PollexyCli')
+    if verbose:
+        os.environ['LOG_LEVEL'] = 'DEBUG'
+        log.setLevel(logging.DEBUG)
+    s = Scheduler()
+    count = s.reindex_messages()
+    click.echo('Reindexed {} messages'.format(count))
+
+
 @message.command('list')
 @click.argument('person_name')
 @click.option('--include_expired/--dont_include_expired', default=False)
@@ -360,6 +395,10 @@ def list(person_name, include_expired, verbose):
 @click.option('--simulate/--dont_simulate', default=False)
 @click.option('--voice_id')
 @click.option('--fail_confirm/--dont_fail_confirm', default=False)
+@click.option('--stream/--no_stream', default=False,
+              help='Start playing speech before synthesis finishes')
+@click.option('--max_idle_seconds', default=IDLE_BACKOFF_MAX_SECONDS,
+              help='Longest rest between polls of an empty queue')
 @click.option('--verbose/--no-verbose', default=False)
 def speak(person_name,
           location_name,
@@ -369,25 +408,31 @@ def speak(person_name,
           no_audio,
           simulate,
           fail_confirm,
+          stream,
+          max_idle_seconds,
           verbose):
     log = logging.getLogger('PollexyCli')
     if verbose:
         os.environ['LOG_LEVEL'] = 'DEBUG'
         log.setLevel(logging.DEBUG)
-    try:
-        while True:
-            lm = LocationManager()
-            loc = lm.get_location(location_name)
-            if not ignore_motion and not loc.is_motion:
-                print 'Exiting. No motion detected at ' + location_name
-                exit(1)
-            speaker = Speaker(NoAudio=no_audio)
-            message_manager = MessageManager(LocationName=location_name)
-            bm = message_manager.get_messages(MessageType='Bot',
-                                              PersonName=person_name)
-            if bm and len(bm) > 0:
-                log.debug('Bot count = {}'.format(len(bm)))
-                for bot in bm:
+    agent = LocationAgent(PersonName=person_name,
+                          LocationName=location_name,
+                          VoiceId=voice_id,
+                          NoAudio=no_audio,
+                          Streaming=stream,
+                          DontDelete=simulate,
+                          MaxIdleSeconds=max_idle_seconds)
+    runtime = DeviceRuntime()
+    pm = PersonManager()
+
+    def converse():
+        while not runtime.stopping.is_set():
+            bot_job = agent.next_bot_job(Timeout=QUEUE_POLL_SECONDS)
+            if not bot_job:
+                continue
+            log.debug('Bot count = {}'.format(len(bot_job.bots)))
+            with runtime.floor:
+                for bot in bot_job.bots:
                     username = str(uuid.uuid4())
                     try:
                         lp = LexPlayer(
@@ -404,48 +449,57 @@ def speak(person_name,
                     except Exception as e:
                         print 'Bot failed: {}'.format(e)
                         raise
-                message_manager.succeed_messages(dont_delete=simulate)
-
-            cache_manager = CacheManager(BucketName='pollexy-media',
-                                         CacheName='chimes')
-            cache_manager.sync_remote_folder()
-            vid, speech = message_manager.write_speech(PersonName=person_name)
-            if vid:
-                voice_id = vid
-            if not speech:
-                message_manager.succeed_messages(dont_delete=simulate)
-                message_manager.delete_sqs_msgs()
+            runtime.submit(agent.succeed_bot_job, bot_job)
+
+    def deliver():
+        while not runtime.stopping.is_set():
+            # the next message is synthesized in the background while
+            # this one plays
+            job = agent.next_job()
+            if not job:
+                continue
+            voice_id = job.voice_id
+            p = pm.get_person(person_name)
+            do_speech = True
+            with runtime.floor:
+                if fail_confirm:
+                    log.warn("FORCE FAILING confirmation")
+                    reason, do_speech = "NoResponse", False
+
+                elif not no_audio and p.require_physical_confirmation and \
+                        not ignore_confirmation:
+                    lv = LocationVerification(PersonName=person_name,
+                                              LocationName=location_name,
+                                              VoiceId=voice_id)
+                    do_speech, retry_count, timeout = \
+                        lv.verify_person_at_location(SpeechMethod=say)
+                log.debug('do_speech={}'.format(bool(do_speech)))
+                if not fail_confirm and do_speech:
+                    log.debug('starting speech')
+                    job.speaker.speak(IncludeChime=True)
+            if fail_confirm:
+                agent.fail(job, reason)
             else:
-                try:
-                    pm = PersonManager()
-                    p = pm.get_person(person_name)
-                    do_speech = True
-                    if fail_confirm:
-                        log.warn("FORCE FAILING confirmation")
-                        reason, do_speech = "NoResponse", False
-
-                    elif not no_audio and p.require_physical_confirmation and \
-                            not ignore_confirmation:
-                        lv = LocationVerification(PersonName=person_name,
-                                                  LocationName=location_name,
-                                                  VoiceId=voice_id)
-                        do_speech, retry_count, timeout = \
-                            lv.verify_person_at_location(SpeechMethod=say)
-                    log.debug('do_speech={}'.format(bool(do_speech)))
-                    if fail_confirm:
-                        message_manager.fail_messages(Reason=reason)
-                    else:
-                        if do_speech:
-                            log.debug('starting speech')
-                            speaker = Speaker(NoAudio=no_audio)
-                            speaker.generate_audio(Message=speech,
-                                                   TextType='ssml',
-                                                   VoiceId=voice_id)
-                            speaker.speak(IncludeChime=True)
-                        log.debug('Succeeding messages')
-                        message_manager.succeed_messages(dont_delete=simulate)
-                finally:
-                    speaker.cleanup()
+                log.debug('Succeeding messages')
+                agent.succeed(job)
+
+    try:
+        agent.start()
+        location_state = LocationStateCache(LocationName=location_name)
+        cache_manager = CacheManager(BucketName='pollexy-media',
+                                     CacheName='chimes')
+        runtime.every('cache-sync', SYNC_TTL_SECONDS,
+                      cache_manager.sync_remote_folder)
+        runtime.spawn('conversations', converse)
+        runtime.spawn('deliveries', deliver)
+        while True:
+            loc = location_state.get()
+            if not ignore_motion and not loc.is_motion:
+                print 'Exiting. No motion detected at ' + location_name
+                exit(1)
+            agent.check_motion(loc)
+            if not runtime.wait(QUEUE_POLL_SECONDS):
+                break
 
     except Exception as exc:
         exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -453,6 +507,11 @@ def speak(person_name,
                    exc_traceback))
         click.echo("Error: %s" % str(exc))
         exit(2)
+    finally:
+        runtime.stop()
+        agent.stop()
+        stop_audio_engine()
+        log.debug('Poll stats: {}'.format(agent.stats()))
 
 
 @message.command('queue')
@@ -476,49 +535,61 @@ def queue(simulate, simulated_date, verbose):
             return
 
         log.debug("Number of messages to be scheduled: %s" % len(msgs))
+        people = PersonRepository()
+        if not simulate:
+            people.load([m.person_name for m in msgs])
+        batch = []
+        queued = []
         for m in msgs:
             if not simulate:
-                pm = PersonManager()
-                p = pm.get_person(m.person_name)
+                p = people.get_person(m.person_name)
                 if not p:
                     log.warn(m.person_name +
                              "does not have an entry in the " +
                              "Person table")
                     continue
-                if p.all_available_count(dt) == 0:
+                avail = p.availability(dt)
+                if avail.count == 0:
                     log.debug('No locations available for %s' %
                               m.person_name)
                     continue
-                avail_windows = p.all_available(dt)
                 log.debug('# of locations avail: {}, last_loc={}'
-                          .format(p.all_available_count(dt),
-                                  m.last_loc))
-                if m.last_loc == p.all_available_count(dt)-1:
-                    log.debug('Resetting to first location')
-                    idx = 0
-                else:
-                    log.debug('Moving to next location')
-                    idx = m.last_loc + 1
-
-                active_window = avail_windows[int(idx)]
+                          .format(avail.count, m.last_loc))
+                idx, active_window = avail.pick(m.last_loc)
                 next_exp = m.next_expiration_utc.isoformat()
-                mm = MessageManager(LocationName=active_window.location_name)
                 log.debug("Publishing message for person %s to location %s"
                           % (m.person_name, active_window.location_name))
-                mm.publish_message(Body=m.body, UUID=m.uuid_key,
-                                   PersonName=m.person_name,
-                                   NoMoreOccurrences=m.no_more_occurrences,
-                                   BotNames=m.bot_names,
-                                   RequiredBots=m.required_bots,
-                                   IceBreaker=m.ice_breaker,
-                                   Introduction=m.introduction,
-                                   ExpirationDateTimeInUtc=next_exp)
-                scheduler.update_queue_status(m.uuid_key, m.person_name, True)
-                scheduler.update_last_location(m.uuid_key, m.person_name, idx)
+                batch.append({'LocationName': active_window.location_name,
+                              'Body': m.body,
+                              'UUID': m.uuid_key,
+                              'PersonName': m.person_name,
+                              'NoMoreOccurrences': m.no_more_occurrences,
+                              'BotNames': m.bot_names,
+                              'RequiredBots': m.required_bots,
+                              'IceBreaker': m.ice_breaker,
+                              'ExpirationDateTimeInUtc': next_exp,
+                              'Windows': p.time_windows.to_json()})
+                queued.append((m, idx))
             else:
                 click.echo("Publishing message(simulated):")
                 click.echo(str(m))
 
+        if batch:
+            results = publish_to_locations(batch)
+            for (m, idx), result in zip(queued, results):
+                if not result['Successful']:
+                    log.warn('Unable to publish message {}: {}'
+                             .format(m.uuid_key, result['Error']))
+                    continue
+                try:
+                    scheduler.update_queue_status(m.uuid_key,
+                                                  m.person_name, True)
+                    scheduler.update_last_location(m.uuid_key,
+                                                   m.person_name, idx)
+                except Exception as e:
+                    log.error('Unable to mark message {} as queued: {}'
+                              .format(m.uuid_key, e))
+
     except Exception:
         print 'here'
         click.echo(traceback.print_exc())
@@ -0,0 +1,90 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import boto3
+import threading
+from botocore.config import Config
+
+DEFAULT_MAX_POOL_CONNECTIONS = 10
+
+
+class ClientPool(object):
+    """shares boto3 clients and resources so their HTTP connections are
+    reused across calls
+
+    Clients are thread safe and shared by every thread. Resources are not,
+    so each thread gets its own."""
+    def __init__(self, **kwargs):
+        self.max_pool_connections = kwargs.get('MaxPoolConnections',
+                                               DEFAULT_MAX_POOL_CONNECTIONS)
+        self.region = kwargs.get('Region')
+        self._session = kwargs.get('Session')
+        self._clients = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                self._session = boto3.session.Session()
+            return self._session
+
+    @property
+    def config(self):
+        return Config(max_pool_connections=self.max_pool_connections)
+
+    def client(self, service, region=None):
+        key = (service, region or self.region)
+        client = self._clients.get(key)
+        if client is None:
+            session = self.session
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    client = session.client(service,
+                                            region_name=key[1],
+                                            config=self.config)
+                    self._clients[key] = client
+        return client
+
+    def resource(self, service, region=None):
+        key = (service, region or self.region)
+        if not hasattr(self._local, 'resources'):
+            self._local.resources = {}
+        resource = self._local.resources.get(key)
+        if resource is None:
+            session = self.session
+            with self._lock:
+                resource = session.resource(service,
+                                            region_name=key[1],
+                                            config=self.config)
+            self._local.resources[key] = resource
+        return resource
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+            self._session = None
+        self._local = threading.local()
+
+
+_default_pool = ClientPool()
+
+
+def get_client_pool():
+    return _default_pool
+
+
+def set_client_pool(pool):
+    """replace the process-wide pool, e.g. to size its connection pools"""
+    global _default_pool
+    _default_pool = pool
@@ -11,6 +11,10 @@
 
 import yaml
 import os.path
+import threading
+
+_config = None
+_config_lock = threading.Lock()
 
 
 class ConfigHelper(object):
@@ -26,3 +30,12 @@ class ConfigHelper(object):
             except yaml.YAMLError as exc:
                 print(exc)
         self.config = y
+
+
+def get_config():
+    """/etc/pollexy.yaml, read once per process; empty if there isn't one"""
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = ConfigHelper().config or {}
+        return _config
@@ -9,13 +9,25 @@
 # or implied. See the License for the specific language governing permissions 
 # and limitations under the License.
 
-import boto3
+from helpers.aws_clients import get_client_pool
+import os
+import sys
+import threading
+import time
+import Queue
 
+SCAN_QUEUE_SIZE = 1000
+_SEGMENT_DONE = object()
 
-def does_table_exist(table_name):
+# tables confirmed to exist, by name, with the time they were checked
+_validated_tables = {}
+_validated_tables_lock = threading.Lock()
+
+
+def does_table_exist(table_name, clients=None):
     table_exists = False
     try:
-        client = boto3.client('dynamodb')
+        client = (clients or get_client_pool()).client('dynamodb')
         client.describe_table(TableName=table_name)
         table_exists = True
 
@@ -26,6 +38,102 @@ def does_table_exist(table_name):
     return table_exists
 
 
-def validate_table(table_name, create_table):
-    if (not does_table_exist(table_name)):
+def validate_table(table_name, create_table, clients=None):
+    """create the table if it doesn't exist
+
+    A table is only checked once per process, or once every
+    POLLEXY_TABLE_CHECK_TTL seconds if that is set. With
+    POLLEXY_TRUST_SCHEMA=true the tables are assumed to exist."""
+    if os.environ.get('POLLEXY_TRUST_SCHEMA', '').lower() == 'true':
+        return
+    if is_table_validated(table_name):
+        return
+    if (not does_table_exist(table_name, clients)):
         create_table()
+    with _validated_tables_lock:
+        _validated_tables[table_name] = time.time()
+
+
+def is_table_validated(table_name):
+    with _validated_tables_lock:
+        checked = _validated_tables.get(table_name)
+    if checked is None:
+        return False
+    ttl = os.environ.get('POLLEXY_TABLE_CHECK_TTL')
+    return not ttl or time.time() - checked < float(ttl)
+
+
+def forget_validated_tables():
+    with _validated_tables_lock:
+        _validated_tables.clear()
+
+
+def scan_pages(table, **kwargs):
+    """yield scan pages, following LastEvaluatedKey"""
+    while True:
+        response = table.scan(**kwargs)
+        yield response
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def scan_items(table_name, **kwargs):
+    """yield every item in a table without loading the whole table
+
+    TotalSegments > 1 runs a parallel scan, one thread per segment, feeding a
+    bounded queue so memory stays flat however large the table is. Any other
+    keyword arguments except Clients are passed through to Table.scan."""
+    total_segments = kwargs.pop('TotalSegments', 1)
+    clients = kwargs.pop('Clients', None) or get_client_pool()
+    if total_segments <= 1:
+        table = clients.resource('dynamodb').Table(table_name)
+        for page in scan_pages(table, **kwargs):
+            for item in page['Items']:
+                yield item
+        return
+
+    items = Queue.Queue(maxsize=SCAN_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                items.put(value, timeout=0.5)
+                return
+            except Queue.Full:
+                continue
+
+    def scan_segment(segment):
+        try:
+            # the pool gives each segment thread its own resource
+            table = clients.resource('dynamodb').Table(table_name)
+            for page in scan_pages(table, Segment=segment,
+                                   TotalSegments=total_segments, **kwargs):
+                for item in page['Items']:
+                    put(item)
+                # don't read another page once the consumer has gone
+                if stop.is_set():
+                    break
+        except Exception:
+            put(sys.exc_info())
+        finally:
+            put(_SEGMENT_DONE)
+
+    for segment in range(total_segments):
+        t = threading.Thread(target=scan_segment, args=(segment,))
+        t.daemon = True
+        t.start()
+
+    try:
+        remaining = total_segments
+        while remaining:
+            value = items.get()
+            if value is _SEGMENT_DONE:
+                remaining -= 1
+            elif isinstance(value, tuple):
+                raise value[0], value[1], value[2]
+            else:
+                yield value
+    finally:
+        stop.set()
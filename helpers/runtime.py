@@ -0,0 +1,102 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""long running work on a location device, run side by side"""
+import logging
+import sys
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+
+EXECUTOR_THREADS = 4
+STOP_TIMEOUT_SECONDS = 5
+
+
+class DeviceRuntime(object):
+    """named tasks sharing one device until any of them fails or stop()
+
+    Each task runs on its own thread and is expected to return once
+    stopping is set. Blocking calls that nothing needs to wait on are
+    handed to submit(), which runs them on a small executor. Anything
+    that talks to or listens to the room holds floor, so a conversation
+    and a delivery never speak over each other."""
+    def __init__(self, **kwargs):
+        self.executor = ThreadPool(kwargs.get('ExecutorThreads',
+                                              EXECUTOR_THREADS))
+        self.stopping = threading.Event()
+        self.floor = threading.RLock()
+        self.tasks = {}
+        self.exc_info = None
+        self.lock = threading.Lock()
+
+    def spawn(self, name, target, *args, **kwargs):
+        t = threading.Thread(target=self._run, name=name,
+                             args=(name, target, args, kwargs))
+        t.daemon = True
+        with self.lock:
+            self.tasks[name] = t
+        t.start()
+        return t
+
+    def every(self, name, seconds, target, *args, **kwargs):
+        """call target straight away and then every few seconds"""
+        def repeat():
+            while not self.stopping.is_set():
+                target(*args, **kwargs)
+                self.stopping.wait(seconds)
+        return self.spawn(name, repeat)
+
+    def submit(self, target, *args, **kwargs):
+        """run a blocking call on the executor; failures are only logged"""
+        def call():
+            try:
+                return target(*args, **kwargs)
+            except Exception:
+                logging.exception('Background call failed')
+                raise
+        return self.executor.apply_async(call)
+
+    def _run(self, name, target, args, kwargs):
+        try:
+            target(*args, **kwargs)
+        except Exception:
+            logging.exception('Task {} failed'.format(name))
+            with self.lock:
+                if not self.exc_info:
+                    self.exc_info = sys.exc_info()
+            self.stopping.set()
+
+    def check(self):
+        """re-raise the first task failure in the calling thread"""
+        with self.lock:
+            exc_info = self.exc_info
+        if exc_info:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def wait(self, seconds):
+        """sleep until seconds pass or the runtime stops, then check()"""
+        self.stopping.wait(seconds)
+        self.check()
+        return not self.stopping.is_set()
+
+    def stop(self, **kwargs):
+        timeout = kwargs.get('Timeout', STOP_TIMEOUT_SECONDS)
+        self.stopping.set()
+        deadline = time.time() + timeout
+        with self.lock:
+            tasks = self.tasks.items()
+        for name, t in tasks:
+            t.join(max(deadline - time.time(), 0))
+            if t.is_alive():
+                logging.warn('Task {} is still running'.format(name))
+        self.executor.close()
+        self.executor.join()
@@ -10,22 +10,185 @@
 # and limitations under the License.
 
 import arrow
+import hashlib
+import re
+from helpers.lru_cache import LRUCache
 from helpers.weather import Weather
 
+# Polly rejects SSML longer than this, tags included
+MAX_SSML_CHARS = 3000
+PARAGRAPH_TAG = re.compile(r'<p(\s[^>]*)?>')
+TAG = re.compile(r'(<[^>]*>)')
+SPEAK_TAGS = re.compile(r'^\s*<speak>|</speak>\s*$')
+TOKEN = re.compile(r'\{(\w+)\}')
+TEMPLATE_CACHE_SIZE = 4096
+
+_token_providers = {}
+_template_cache = LRUCache(TEMPLATE_CACHE_SIZE)
+
+
+def register_token(name, provider):
+    """make {name} available in messages; provider(speech_helper) returns
+    the text to put in its place"""
+    _token_providers[name] = provider
+
+
+def unregister_token(name):
+    _token_providers.pop(name, None)
+
+
+class Template(object):
+    """a message body split once into literal text and token names"""
+    def __init__(self, body):
+        self.segments = []
+        pos = 0
+        for match in TOKEN.finditer(body):
+            if match.start() > pos:
+                self.segments.append((False, body[pos:match.start()]))
+            self.segments.append((True, match.group(1)))
+            pos = match.end()
+        if pos < len(body):
+            self.segments.append((False, body[pos:]))
+
+    def render(self, helper):
+        out = []
+        for is_token, text in self.segments:
+            if not is_token:
+                out.append(text)
+            elif text in _token_providers:
+                out.append(helper.token_value(text))
+            else:
+                out.append('{%s}' % text)
+        return ''.join(out)
+
+
+def compile_template(body):
+    data = body.encode('utf-8') if isinstance(body, unicode) else body
+    key = hashlib.sha1(data).hexdigest()
+    template = _template_cache.get(key)
+    if template is None:
+        template = Template(body)
+        _template_cache.put(key, template)
+    return template
+
+
+def tag_depth(tag):
+    """how much an SSML tag changes the element depth"""
+    if tag.startswith('</'):
+        return -1
+    if tag.endswith('/>') or tag.startswith('<?') or tag.startswith('<!'):
+        return 0
+    return 1
+
+
+def split_words(text, max_chars):
+    """split text at whitespace outside of any element into pieces of at
+    most max_chars, unless a single word is longer
+
+    An element such as <prosody>...</prosody> counts as part of the word
+    it is in, so no piece ever opens a tag that another piece closes."""
+    pieces = []
+    current = ''
+    word = ''
+    depth = 0
+    for token in TAG.split(text) + [' ']:
+        if token.startswith('<'):
+            depth += tag_depth(token)
+            word += token
+            continue
+        for c in token:
+            if not c.isspace() or depth > 0:
+                word += c
+                continue
+            if current and len(current) + 1 + len(word) > max_chars:
+                pieces.append(current)
+                current = word
+            elif word:
+                current = current + ' ' + word if current else word
+            word = ''
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def ssml_blocks(body):
+    """the paragraphs of body and the text between them, in order, as
+    (is_paragraph, ssml) pairs"""
+    blocks = []
+    current = ''
+    depth = 0
+    for token in TAG.split(body):
+        if not token.startswith('<'):
+            current += token
+            continue
+        if depth == 0 and PARAGRAPH_TAG.match(token):
+            if current.strip():
+                blocks.append((False, current.strip()))
+            current = ''
+        current += token
+        depth += tag_depth(token)
+        if depth == 0 and token == '</p>':
+            blocks.append((True, current))
+            current = ''
+    if current.strip():
+        blocks.append((False, current.strip()))
+    return blocks
+
+
+def split_ssml(ssml, max_chars=MAX_SSML_CHARS):
+    """split a <speak> document into several, each under max_chars,
+    breaking only between paragraphs unless one paragraph is too long on
+    its own
+
+    Text outside of any paragraph is kept in order as a part of its
+    own."""
+    if len(ssml) <= max_chars:
+        return [ssml]
+    overhead = len('<speak></speak>')
+    parts = []
+    for is_paragraph, block in ssml_blocks(SPEAK_TAGS.sub('', ssml)):
+        if len(block) + overhead <= max_chars:
+            parts.append((is_paragraph, block))
+            continue
+        if not is_paragraph:
+            for piece in split_words(block, max_chars - overhead):
+                parts.append((False, piece))
+            continue
+        open_tag = PARAGRAPH_TAG.match(block).group(0)
+        inner = block[len(open_tag):-len('</p>')]
+        room = max_chars - overhead - len(open_tag) - len('</p>')
+        for piece in split_words(inner, room):
+            parts.append((True, '%s%s</p>' % (open_tag, piece)))
+    chunks = []
+    current = ''
+    last_is_paragraph = True
+    for is_paragraph, part in parts:
+        # bare text runs need a space between them, paragraphs don't
+        sep = '' if is_paragraph or last_is_paragraph else ' '
+        if current and len(current) + len(sep) + len(part) + overhead > \
+                max_chars:
+            chunks.append('<speak>%s</speak>' % current)
+            current = ''
+        current += (sep if current else '') + part
+        last_is_paragraph = is_paragraph
+    if current:
+        chunks.append('<speak>%s</speak>' % current)
+    return chunks
+
 
 class SpeechHelper(object):
     def __init__(self, **kwargs):
         self.person = kwargs.get('PersonName', '')
+        self.values = {}
 
     def replace_tokens(self, msg):
-        msg = msg.replace('{person}', self.person)
-        msg = msg.replace('{greeting}', self.greeting())
+        return compile_template(msg).render(self)
 
-        if '{weather}' in msg:
-            w = Weather()
-            msg = msg.replace('{weather}', w.describe())
-        msg = msg.replace('{datetime}', self.time_and_date())
-        return msg
+    def token_value(self, name):
+        """each token is worked out at most once per helper"""
+        if name not in self.values:
+            self.values[name] = _token_providers[name](self)
+        return self.values[name]
 
     def time_and_date(self):
         d = arrow.utcnow().format('dddd, MMMM DD, YYYY')
@@ -41,3 +204,9 @@ class SpeechHelper(object):
             tod = "evening"
 
         return "Good {}, {}.".format(tod, self.person)
+
+
+register_token('person', lambda h: h.person)
+register_token('greeting', lambda h: h.greeting())
+register_token('weather', lambda h: Weather().describe())
+register_token('datetime', lambda h: h.time_and_date())
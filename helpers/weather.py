@@ -11,13 +11,114 @@
 
 import requests
 import json
-from helpers.config import ConfigHelper
+from helpers.config import get_config
 import logging
+import threading
+import time
+
+
+WEATHER_TTL_SECONDS = 15 * 60
+WEATHER_REFRESH_AHEAD_SECONDS = 60
+WEATHER_REQUEST_TIMEOUT_SECONDS = 10
+
+_weather_provider = None
+_weather_provider_lock = threading.Lock()
+
+
+def fetch_json(url):
+    r = requests.get(url, timeout=WEATHER_REQUEST_TIMEOUT_SECONDS)
+    r.raise_for_status()
+    return json.loads(r.text)
+
+
+class WeatherProvider(object):
+    """wunderground responses cached per feature, state and city
+
+    An entry younger than TtlSeconds is served from memory; inside the
+    last RefreshAheadSeconds it is also refreshed on a background thread.
+    If a refresh fails, the stale entry is served instead. Fetch is the
+    callable that turns a URL into JSON, so tests can stub the network."""
+    def __init__(self, **kwargs):
+        self.ttl = kwargs.get('TtlSeconds', WEATHER_TTL_SECONDS)
+        self.refresh_ahead = kwargs.get('RefreshAheadSeconds',
+                                        WEATHER_REFRESH_AHEAD_SECONDS)
+        self.fetch = kwargs.get('Fetch', fetch_json)
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def get(self, api_key, feature, state, city):
+        key = (api_key, feature, state, city)
+        with self.lock:
+            entry = self.entries.get(key)
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        if entry:
+            age = time.time() - entry[0]
+            if age < self.ttl:
+                if age >= self.ttl - self.refresh_ahead:
+                    self.refresh_in_background(key)
+                return entry[1]
+        with key_lock:
+            # someone else may have fetched it while we waited
+            with self.lock:
+                entry = self.entries.get(key)
+            if entry and time.time() - entry[0] < self.ttl:
+                return entry[1]
+            try:
+                return self.refresh(key)
+            except Exception:
+                if not entry:
+                    raise
+                logging.exception('Weather refresh failed, using data from '
+                                  '{} seconds ago'
+                                  .format(int(time.time() - entry[0])))
+                return entry[1]
+
+    def refresh(self, key):
+        api_key, feature, state, city = key
+        url = "http://api.wunderground.com/api/" + \
+            "{}/{}/q/{}/{}.json".format(api_key, feature, state, city)
+        data = self.fetch(url)
+        with self.lock:
+            self.entries[key] = (time.time(), data)
+        return data
+
+    def refresh_in_background(self, key):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(key)
+            except Exception:
+                logging.exception('Background weather refresh failed')
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def get_weather_provider():
+    global _weather_provider
+    with _weather_provider_lock:
+        if _weather_provider is None:
+            _weather_provider = WeatherProvider()
+        return _weather_provider
 
 
 class Weather(object):
     def __init__(self, **kwargs):
-        c = ConfigHelper().config
+        self.provider = kwargs.get('Provider') or get_weather_provider()
+        c = get_config()
         if 'wunderground_api_key' not in c.keys() or \
                 'weather_state' not in c.keys() or \
                 'weather_city' not in c.keys():
@@ -31,7 +132,6 @@ class Weather(object):
         logging.info('Weather state={}, city={}'.format(self.state, self.city))
 
     def get_feel(self, temp):
-        print 'temp is {}'.format(temp)
         if temp > 80:
             feel = "hot"
             in_clothes = "shorts and a t-shirt"
@@ -57,7 +157,6 @@ class Weather(object):
 
     def get_forecast(self):
         j = self.make_request('forecast')
-        print j
         t = j["forecast"]["simpleforecast"]["forecastday"][0]
         self.f_high = int(t["high"]['fahrenheit'])
         self.f_low = int(t["low"]['fahrenheit'])
@@ -84,9 +183,4 @@ class Weather(object):
                         self.f_in)
 
     def make_request(self, ft):
-        w = "http://api.wunderground.com/api/" + \
-            "{}/{}/q/{}/{}.json".format(self.api_key, ft, self.state,
-                                        self.city)
-        r = requests.get(w)
-        j = json.loads(r.text)
-        return j
+        return self.provider.get(self.api_key, ft, self.state, self.city)
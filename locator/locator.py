@@ -10,9 +10,9 @@
 # and limitations under the License.
 
 import arrow
-import boto3
 import json
-from helpers.db_helpers import validate_table
+from helpers.aws_clients import get_client_pool
+from helpers.db_helpers import validate_table, scan_items
 from boto3.dynamodb.conditions import Key
 from babylex import LexSession
 from person.person import PersonManager
@@ -20,10 +20,14 @@ from time_window import TimeWindow, TimeWindowSet
 import logging
 import uuid
 import random
+import time
 from input.switch import Switch
 
 LOCATION_TABLE = 'PollexyLocations'
 HASH_KEY = 'LocationName'
+LOCATION_STATE_TTL_SECONDS = 10
+LOCATION_STATE_MAX_AGE_SECONDS = 300
+MOTION_WINDOW_SECONDS = 60
 
 
 def display(cal):
@@ -41,7 +45,7 @@ class LocationFinder(object):
 class LocationAvailability(object):
     def __init__(self, **kwargs):
         self.location_name = kwargs.get('LocationName', '')
-        self.time_windows = TimeWindowSet()
+        self.time_windows = TimeWindowSet(IntervalIndex=True)
         self.output_capabilities = {}
         self.input_capabilities = {}
 
@@ -80,10 +84,12 @@ class LocationStatus(object):
 
 class LocationManager(object):
     def __init__(self, **kwargs):
-        validate_table(LOCATION_TABLE, self.create_location_table)
+        self.clients = kwargs.get('Clients') or get_client_pool()
+        validate_table(LOCATION_TABLE, self.create_location_table,
+                       self.clients)
 
     def create_location_table(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.create_table(
                     TableName=LOCATION_TABLE,
                     KeySchema=[
@@ -108,7 +114,7 @@ class LocationManager(object):
 
     def upsert(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -122,7 +128,7 @@ class LocationManager(object):
 
     def delete(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.delete_item(
             Key={
@@ -131,7 +137,7 @@ class LocationManager(object):
         )
 
     def update_location_activity(self, loc_name):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -144,7 +150,7 @@ class LocationManager(object):
         )
 
     def toggle_mute(self, loc_name, is_muted=False):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -157,7 +163,7 @@ class LocationManager(object):
         )
 
     def update_input_capabilities(self, loc_avail):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -170,7 +176,7 @@ class LocationManager(object):
         )
 
     def update_window_set(self, loc_avail):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         table.update_item(
             Key={
@@ -198,10 +204,7 @@ class LocationManager(object):
         if 'last_activity' in db_loc.keys():
             la.last_activity = arrow.get(db_loc['last_activity'])
             logging.info('Last motion was ' + la.last_activity.isoformat())
-            if ((arrow.utcnow()-la.last_activity).seconds > 60):
-                la.is_motion = False
-            else:
-                la.is_motion = True
+            la.is_motion = is_recent_motion(la.last_activity)
 
         if 'input_capabilities' in db_loc.keys():
             for k in json.loads(db_loc['input_capabilities']):
@@ -216,7 +219,7 @@ class LocationManager(object):
         return la
 
     def get_location(self, loc_name):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(LOCATION_TABLE)
         response = table.query(
             Select='ALL_ATTRIBUTES',
@@ -226,19 +229,83 @@ class LocationManager(object):
         else:
             return self.convert_to_loc_avail(response['Items'][0])
 
-    def get_all(self):
-        dynamodb = boto3.client('dynamodb')
-        response = dynamodb.scan(
-            Select='ALL_ATTRIBUTES',
-            TableName=LOCATION_TABLE)
-
-        locs = []
-        if len(response['Items']) == 0:
+    def get_last_activity(self, loc_name):
+        """just the raw last_activity value, or None"""
+        dynamodb = self.clients.resource('dynamodb')
+        table = dynamodb.Table(LOCATION_TABLE)
+        response = table.get_item(
+            Key={HASH_KEY: loc_name},
+            ProjectionExpression='last_activity')
+        return response.get('Item', {}).get('last_activity')
+
+    def iter_all(self, **kwargs):
+        total_segments = kwargs.get('TotalSegments', 1)
+        for i in scan_items(LOCATION_TABLE, TotalSegments=total_segments,
+                            Clients=self.clients):
+            yield self.convert_to_loc_avail(i)
+
+    def get_all(self, **kwargs):
+        locs = list(self.iter_all(**kwargs))
+        if len(locs) == 0:
             return None
+        return locs
+
+
+def is_recent_motion(last_activity):
+    return (arrow.utcnow() - last_activity).seconds <= MOTION_WINDOW_SECONDS
+
+
+class LocationStateCache(object):
+    """one location's details kept between polls
+
+    After TtlSeconds only last_activity is read back, and the full location
+    is reloaded when that has changed or the copy is MaxAgeSeconds old.
+    Motion is worked out from last_activity on every get(), and
+    last_activity is read back as soon as motion runs out."""
+    def __init__(self, **kwargs):
+        self.location_name = kwargs.get('LocationName')
+        self.manager = kwargs.get('LocationManager') or \
+            LocationManager(Clients=kwargs.get('Clients'))
+        self.ttl = kwargs.get('TtlSeconds', LOCATION_STATE_TTL_SECONDS)
+        self.max_age = kwargs.get('MaxAgeSeconds',
+                                  LOCATION_STATE_MAX_AGE_SECONDS)
+        self.location = None
+        self.last_activity = None
+        self.loaded_at = 0
+        self.checked_at = 0
+
+    def reload(self):
+        self.location = self.manager.get_location(self.location_name)
+        self.last_activity = getattr(self.location, 'last_activity', None)
+        self.loaded_at = self.checked_at = time.time()
+
+    def check(self, now):
+        """read last_activity back and reload if it has changed"""
+        last_activity = self.manager.get_last_activity(self.location_name)
+        if last_activity:
+            last_activity = arrow.get(last_activity)
+        if last_activity != self.last_activity:
+            self.reload()
         else:
-            for i in response['Items']:
-                locs.append(self.convert_to_loc_avail(i))
-            return locs
+            self.checked_at = now
+
+    def get(self):
+        now = time.time()
+        if self.location is None or now - self.loaded_at >= self.max_age:
+            self.reload()
+        elif now - self.checked_at >= self.ttl:
+            self.check(now)
+        if self.last_activity is None:
+            return self.location
+        is_motion = is_recent_motion(self.last_activity)
+        if not is_motion and getattr(self.location, 'is_motion', False) and \
+                self.checked_at < now:
+            # motion just ran out on the cached copy: read last_activity
+            # back once rather than wait for the TTL to report no motion
+            self.check(now)
+            is_motion = is_recent_motion(self.last_activity)
+        self.location.is_motion = is_motion
+        return self.location
 
 
 class LocationVerification(object):
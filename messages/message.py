@@ -16,9 +16,36 @@ import uuid
 import arrow
 from dateutil.rrule import rrulestr
 from helpers.datetime_helpers import check_if_timezone_naive
+from helpers.lru_cache import LRUCache
 from icalendar import Event, Calendar
 import logging
 
+RULE_CACHE_SIZE = 1024
+_rule_cache = LRUCache(RULE_CACHE_SIZE)
+_MISSING = object()
+
+
+def get_rule(ical, dtstart):
+    """parsed recurrence rule for an ical string, or None if it has no RRULE
+
+    Rules are shared process-wide, keyed by (ical, dtstart)"""
+    if dtstart is None:
+        # rrulestr falls back to the current time, which can't be cached
+        return _parse_rule(ical, dtstart)
+    key = (ical, dtstart)
+    rule = _rule_cache.get(key, _MISSING)
+    if rule is _MISSING:
+        rule = _parse_rule(ical, dtstart)
+        _rule_cache.put(key, rule)
+    return rule
+
+
+def _parse_rule(ical, dtstart):
+    cal = Calendar.from_ical(ical)
+    if not cal.get('RRULE'):
+        return None
+    return rrulestr(cal.get('RRULE').to_ical(), dtstart=dtstart)
+
 
 class ScheduledMessage(object):
     def __init__(self, **kwargs):
@@ -55,8 +82,10 @@ class ScheduledMessage(object):
                 raise ValueError("Start datetime is after end datetime")
         if (not self.body):
             raise ValueError("Message body is empty")
-        self.no_more_occurrences = str(self.next_occurrence_utc) == 'N/A'
-        logging.debug(self.__str__())
+        # recurrence fields are computed on first access
+        self._occurrence_memo = None
+        self._no_more_occurrences = None
+        logging.debug('%s', self)
 
     def to_ical(self):
         if self.ical:
@@ -106,6 +135,13 @@ class ScheduledMessage(object):
             'body: %s' % self.body
         ])
 
+    @property
+    def no_more_occurrences(self):
+        if self._no_more_occurrences is None:
+            self._no_more_occurrences = \
+                str(self.next_occurrence_utc) == 'N/A'
+        return self._no_more_occurrences
+
     @property
     def start_datetime_local(self):
         if self.start_datetime_in_utc:
@@ -162,6 +198,15 @@ class ScheduledMessage(object):
             return False
 
     def next_occurrence(self):
+        compare = self.compare_datetime_in_utc or arrow.utcnow().datetime
+        state = (self.ical, self.start_datetime_in_utc,
+                 self.end_datetime_in_utc, self.last_occurrence_in_utc)
+        # a result holds until the compare time reaches the next occurrence
+        memo = self._occurrence_memo
+        if memo and memo[0] == state and \
+                (memo[1] is None or memo[1] <= compare < memo[2]):
+            return memo[3]
+
         # if not messages have been queued yet, then the next occurrence
         # is the start time
         next_occur = None
@@ -170,15 +215,14 @@ class ScheduledMessage(object):
             next_expire = arrow.get(next_occur).replace(minutes=+10)
             if self.end_datetime_in_utc < next_expire:
                 next_expire = self.end_datetime_in_utc
+            self._occurrence_memo = (state, None, None,
+                                     (next_occur, next_expire))
             return next_occur, next_expire
         else:
             start = self.start_datetime_in_utc.datetime
-            cal = Calendar.from_ical(self.ical)
-            if cal.get('RRULE'):
-                rrule = cal.get('RRULE').to_ical()
-                rule = rrulestr(rrule, dtstart=start)
-                next_after_now = rule.after(self.compare_datetime_in_utc or
-                                            arrow.utcnow().datetime)
+            rule = get_rule(self.ical, start)
+            if rule:
+                next_after_now = rule.after(compare)
             else:
                 next_after_now = None
 
@@ -191,13 +235,15 @@ class ScheduledMessage(object):
                 next_occur = next_after_now
             else:
                 next_occur = next_before_now
-        rule = rrulestr(rrule, dtstart=next_occur)
+        rule = get_rule(self.ical, next_occur)
         expires = rule.after(next_occur)
         if not expires:
             return 'N/A', arrow.utcnow().replace(minutes=+10)
         if (expires > self.end_datetime_in_utc):
             expires = self.end_datetime_in_utc
-        return arrow.get(next_occur), arrow.get(expires)
+        occurrence = arrow.get(next_occur), arrow.get(expires)
+        self._occurrence_memo = (state, compare, next_after_now, occurrence)
+        return occurrence
 
     def is_message_ready(self, **kwargs):
         if self.is_expired or self.is_queued:
@@ -10,7 +10,7 @@
 # and limitations under the License.
 
 """interacts with the message queue, reading and publishing messages"""
-import boto3
+from helpers.aws_clients import get_client_pool
 from message import QueuedMessage
 from scheduler.scheduler import Scheduler
 import logging
@@ -19,36 +19,193 @@ from helpers.speech import SpeechHelper
 from helpers.db_helpers import validate_table
 import uuid
 import os
+import threading
+import time
 
 MESSAGE_LIBRARY_TABLE = 'PollexyMessageLibrary'
+SQS_BATCH_SIZE = 10
+SQS_BATCH_RETRIES = 3
+SQS_RETRY_DELAY_SECONDS = 0.2
+MAX_MESSAGES_PER_RECEIVE = 100
+RECEIVE_TIME_BUDGET_SECONDS = 10
+QUEUE_CACHE_TTL_SECONDS = 300
+_queue_cache = {}
+_queue_cache_lock = threading.Lock()
+MESSAGE_ATTRIBUTE_NAMES = ['NoMoreOccurrences',
+                           'ExpirationDateTimeInUtc',
+                           'PersonName',
+                           'Voice',
+                           'BotNames',
+                           'RequiredBots',
+                           'IceBreaker',
+                           'UUID']
 
 
-def get_queue(queue_name):
-    """get a queue by name"""
+def failed_result(error):
+    """the result recorded for a message that couldn't be sent at all"""
+    return {'Successful': False,
+            'Error': type(error).__name__,
+            'Message': str(error)}
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def run_batches(request, entries, retries=SQS_BATCH_RETRIES):
+    """run an SQS batch request over entries, SQS_BATCH_SIZE at a time
+
+    request is called with Entries=[...] and must return the usual
+    Successful/Failed response. Entries that fail on the SQS side are
+    retried with a growing delay; sender faults are not. If a request
+    raises, its entries are recorded as failed and the remaining chunks
+    are still sent. Returns a dict of entry Id to result."""
+    log = logging.getLogger("MessageManager")
+    results = {}
+    for chunk in chunks(entries, SQS_BATCH_SIZE):
+        pending = chunk
+        attempt = 0
+        while pending:
+            try:
+                resp = request(Entries=pending)
+            except Exception as e:
+                log.error('Batch request failed: {}'.format(e))
+                for entry in pending:
+                    results[entry['Id']] = failed_result(e)
+                break
+            for ok in resp.get('Successful', []):
+                result = {'Successful': True}
+                if 'MessageId' in ok:
+                    result['MessageId'] = ok['MessageId']
+                results[ok['Id']] = result
+            retry_ids = set()
+            for failed in resp.get('Failed', []):
+                results[failed['Id']] = {'Successful': False,
+                                         'Error': failed.get('Code'),
+                                         'Message': failed.get('Message')}
+                if not failed.get('SenderFault'):
+                    retry_ids.add(failed['Id'])
+            attempt += 1
+            if not retry_ids or attempt > retries:
+                break
+            log.debug('Retrying {} failed entries'.format(len(retry_ids)))
+            time.sleep(SQS_RETRY_DELAY_SECONDS * attempt)
+            pending = [retry for retry in pending
+                       if retry['Id'] in retry_ids]
+    return results
+
+
+def send_batch(queue, entries, retries=SQS_BATCH_RETRIES):
+    """send entries to a queue with send_message_batch"""
+    return run_batches(queue.send_messages, entries, retries)
+
+
+def delete_batch(client, queue_url, receipt_handles,
+                 retries=SQS_BATCH_RETRIES):
+    """delete messages with delete_message_batch"""
+    entries = [{'Id': str(i), 'ReceiptHandle': r}
+               for i, r in enumerate(receipt_handles)]
+
+    def request(**kwargs):
+        return client.delete_message_batch(QueueUrl=queue_url, **kwargs)
+    return run_batches(request, entries, retries)
+
+
+def change_visibility_batch(client, queue_url, receipt_handles,
+                            visibility_timeout, retries=SQS_BATCH_RETRIES):
+    """reset message visibility with change_message_visibility_batch, so
+    the messages are received again after visibility_timeout seconds"""
+    entries = [{'Id': str(i), 'ReceiptHandle': r,
+                'VisibilityTimeout': visibility_timeout}
+               for i, r in enumerate(receipt_handles)]
+
+    def request(**kwargs):
+        return client.change_message_visibility_batch(QueueUrl=queue_url,
+                                                      **kwargs)
+    return run_batches(request, entries, retries)
+
+
+def publish_to_locations(messages):
+    """publish messages to their locations' queues in batches
+
+    Each message is a dict of publish_message arguments plus LocationName.
+    Returns one result dict per message, in the order given. A location
+    that can't be published to fails only its own messages."""
+    log = logging.getLogger("MessageManager")
+    by_location = {}
+    for i, m in enumerate(messages):
+        by_location.setdefault(m['LocationName'].lower(), []).append(i)
+    results = [None] * len(messages)
+    for location_name, indexes in by_location.items():
+        batch = []
+        for i in indexes:
+            kwargs = dict(messages[i])
+            kwargs.pop('LocationName')
+            batch.append(kwargs)
+        try:
+            mm = MessageManager(LocationName=location_name)
+            location_results = mm.publish_messages(batch)
+        except Exception as e:
+            log.error('Unable to publish to {}: {}'.format(location_name, e))
+            location_results = [failed_result(e)] * len(indexes)
+        for i, result in zip(indexes, location_results):
+            results[i] = result
+    return results
+
+
+def get_queue(queue_name, clients=None):
+    """get a queue by name, or None if it doesn't exist
+
+    Queue URLs are cached for QUEUE_CACHE_TTL_SECONDS; the Queue resource
+    itself comes from clients, which keeps one per thread."""
     log = logging.getLogger("GetQueue")
     if os.environ.get('LOG_LEVEL') == 'DEBUG':
         log.setLevel(logging.DEBUG)
-    sqs = boto3.resource('sqs')
-    client = boto3.client('sqs')
-    queue_url = ""
+    clients = clients or get_client_pool()
+    key = (clients.region, queue_name)
+    with _queue_cache_lock:
+        cached = _queue_cache.get(key)
+    if cached and cached[0] > time.time():
+        return clients.resource('sqs').Queue(cached[1])
+
     try:
         log.debug('Getting queue: {}'.format(queue_name))
-        queue_url = client.get_queue_url(QueueName=queue_name)
+        queue_url = clients.client('sqs').get_queue_url(QueueName=queue_name)
 
     except Exception as e:
         log.error('Error getting queue: {}'.format(e))
         return None
 
-    for queue in sqs.queues.all():
-        if queue.url == queue_url['QueueUrl']:
-            log.debug('Queue already exists')
-            return queue
+    cache_queue_url(key, queue_url['QueueUrl'])
+    return clients.resource('sqs').Queue(queue_url['QueueUrl'])
+
+
+def get_or_create_queue(queue_name, clients=None):
+    clients = clients or get_client_pool()
+    queue = get_queue(queue_name, clients)
+    if queue is None:
+        queue = clients.resource('sqs').create_queue(QueueName=queue_name)
+        cache_queue_url((clients.region, queue_name), queue.url)
+    return queue
+
+
+def cache_queue_url(key, queue_url):
+    with _queue_cache_lock:
+        _queue_cache[key] = (time.time() + QUEUE_CACHE_TTL_SECONDS,
+                             queue_url)
+
+
+def clear_queue_cache():
+    with _queue_cache_lock:
+        _queue_cache.clear()
 
 
 class MessageManager(object):
     """interacts with the message queue"""
     def __init__(self, **kwargs):
         self.log = logging.getLogger("MessageManager")
+        self.clients = kwargs.get('Clients') or get_client_pool()
         if os.environ.get('LOG_LEVEL') == 'DEBUG':
             self.log.setLevel(logging.DEBUG)
         self.location_name = kwargs.get("LocationName", "").lower()
@@ -64,20 +221,13 @@ class MessageManager(object):
 
     def validate_queue(self):
         """validate the queue and create if it doesn't exist"""
-        sqs = boto3.resource('sqs')
         queue = None
         bot_queue = None
         self.log.debug('Validating queue')
         try:
-            bot_queue = get_queue(self.bot_queue_name)
-            if bot_queue is None:
-                self.log.debug('Bot queue does not exist, creating {}'
-                               .format(self.bot_queue_name))
-                bot_queue = sqs.create_queue(QueueName=self.bot_queue_name)
-            queue = get_queue(self.queue_name)
-            if queue is None:
-                self.log.debug('Message queue does not exist, creating . . .')
-                queue = sqs.create_queue(QueueName=self.queue_name)
+            bot_queue = get_or_create_queue(self.bot_queue_name,
+                                            self.clients)
+            queue = get_or_create_queue(self.queue_name, self.clients)
         except Exception as e:
             self.log.error(e)
             self.is_valid_queue = False
@@ -90,39 +240,55 @@ class MessageManager(object):
             self.bot_queue = bot_queue
 
     def get_messages(self, **kwargs):
+        """drain the queue into self.messages, keyed by person
+
+        The first receive long-polls for WaitTimeSeconds; later receives
+        return immediately, until the queue is empty or MaxTotalMessages or
+        TimeBudgetSeconds is reached. With PersonName, messages for anyone
+        else are made visible again straight away. VisibilityTimeout keeps
+        the received messages hidden for that many seconds instead of the
+        queue's default."""
         person_name = kwargs.get('PersonName', '')
         message_type = kwargs.get('MessageType', 'Message')
         wait_time_seconds = kwargs.get('WaitTimeSeconds', 0)
-        max_number_of_messages = kwargs.get('MaxNumberOfMessages', 10)
+        max_number_of_messages = min(kwargs.get('MaxNumberOfMessages', 10),
+                                     SQS_BATCH_SIZE)
+        max_total = kwargs.get('MaxTotalMessages', MAX_MESSAGES_PER_RECEIVE)
+        time_budget = kwargs.get('TimeBudgetSeconds',
+                                 RECEIVE_TIME_BUDGET_SECONDS)
+        receive_args = {}
+        if kwargs.get('VisibilityTimeout') is not None:
+            receive_args['VisibilityTimeout'] = kwargs['VisibilityTimeout']
         self.sqs_msgs = []
+        self.messages = {}
         self.log.debug("Checking messages in the queue, person={}, type={}"
                        .format(person_name, message_type))
-        messages = {}
         queue = None
         if message_type == "Message":
             queue = self.queue
         else:
             queue = self.bot_queue
-        messages = queue.receive_messages(
-            MessageAttributeNames=['NoMoreOccurrences',
-                                   'ExpirationDateTimeInUtc',
-                                   'PersonName',
-                                   'Voice',
-                                   'BotNames',
-                                   'RequiredBots',
-                                   'IceBreaker',
-                                   'UUID'],
-            WaitTimeSeconds=wait_time_seconds,
-            MaxNumberOfMessages=max_number_of_messages)
-        self.log.debug(len(messages))
-        if len(messages) > 0:
+        started = time.time()
+        received = 0
+        msgs = []
+        skipped = []
+        while received < max_total:
+            messages = queue.receive_messages(
+                MessageAttributeNames=MESSAGE_ATTRIBUTE_NAMES,
+                WaitTimeSeconds=wait_time_seconds,
+                MaxNumberOfMessages=min(max_number_of_messages,
+                                        max_total - received),
+                **receive_args)
+            if not messages:
+                break
             self.log.debug('Received {}:'.format(len(messages)))
-            msgs = []
+            received += len(messages)
             for m in messages:
                 qm = QueuedMessage(QueuedMessage=m)
                 if person_name and not qm.person_name == person_name:
                     self.log.debug('Skipping message for {}, looking for {}'
                                    .format(qm.person_name, person_name))
+                    skipped.append(m)
                     continue
                 if qm.person_name not in self.messages:
                     self.log.debug("First message for " + qm.person_name)
@@ -130,50 +296,92 @@ class MessageManager(object):
                 self.messages[qm.person_name].append(qm)
                 self.sqs_msgs.append(m)
                 msgs.append(qm)
-                scheduler = Scheduler()
+            wait_time_seconds = 0
+            if time.time() - started >= time_budget:
+                self.log.debug('Receive time budget reached')
+                break
+
+        if skipped:
+            self.release_sqs_msgs(skipped, VisibilityTimeout=0)
+        if msgs:
+            scheduler = Scheduler(Clients=self.clients)
+            for qm in msgs:
                 scheduler.update_queue_status(qm.uuid_key,
                                               qm.person_name,
                                               False)
-                return msgs
+        return msgs
 
     def write_speech(self, **kwargs):
         dont_delete = kwargs.get('DontDelete', False)
         person_name = kwargs.get('PersonName', '')
         self.log.debug('Getting messages for {}'.format(person_name))
-        self.get_messages(DontDelete=dont_delete, PersonName=person_name)
-        if len(self.messages) == 0:
+        self.get_messages(DontDelete=dont_delete, PersonName=person_name,
+                          WaitTimeSeconds=kwargs.get('WaitTimeSeconds', 0),
+                          VisibilityTimeout=kwargs.get('VisibilityTimeout'))
+        if len(self.messages.get(person_name, [])) == 0:
             return None, None
+        sh = SpeechHelper(PersonName=person_name)
         speech = "<speak>"
         for m in self.messages[person_name]:
             if not m.is_expired:
-                speech = speech + "<p>%s</p>" % m.body
+                speech = speech + "<p>%s</p>" % sh.replace_tokens(m.body)
         if speech == "<speak>":
             return None, None
         speech = "%s</speak>" % speech
-        sh = SpeechHelper(PersonName=person_name)
-        return m.voice_id, sh.replace_tokens(speech)
+        return m.voice_id, speech
 
-    def delete_sqs_msgs(self):
-        client = boto3.client('sqs')
-        self.log.debug('Deleting {} messages'.format(len(self.sqs_msgs)))
-        for m in self.sqs_msgs:
-            self.log.debug('Deleting message from queue')
-            client.delete_message(QueueUrl=m.queue_url,
-                                  ReceiptHandle=m.receipt_handle)
+    def delete_sqs_msgs(self, **kwargs):
+        """delete the received messages, or with VisibilityTimeout leave
+        them on the queue to be received again after that many seconds"""
+        self.release_sqs_msgs(self.sqs_msgs, **kwargs)
+        self.sqs_msgs = []
+
+    def hold_sqs_msgs(self, **kwargs):
+        """keep the received messages hidden for another VisibilityTimeout
+        seconds, without giving them up"""
+        self.release_sqs_msgs(self.sqs_msgs,
+                              VisibilityTimeout=kwargs['VisibilityTimeout'])
+
+    def release_sqs_msgs(self, sqs_msgs, **kwargs):
+        visibility_timeout = kwargs.get('VisibilityTimeout')
+        client = self.clients.client('sqs')
+        by_queue = {}
+        for m in sqs_msgs:
+            by_queue.setdefault(m.queue_url, []).append(m.receipt_handle)
+        for queue_url, receipts in by_queue.items():
+            if visibility_timeout is None:
+                self.log.debug('Deleting {} messages'.format(len(receipts)))
+                results = delete_batch(client, queue_url, receipts)
+            else:
+                self.log.debug('Hiding {} messages for {}s'
+                               .format(len(receipts), visibility_timeout))
+                results = change_visibility_batch(client, queue_url,
+                                                  receipts,
+                                                  visibility_timeout)
+            for result in results.values():
+                if not result['Successful']:
+                    self.log.warn('Unable to release message: {}'
+                                  .format(result['Error']))
 
     def fail_messages(self, **kwargs):
         logging.info('Speech failed: ' + kwargs.get('Reason',
                                                     'Unknown Reason'))
         dont_delete = kwargs.get('DontDelete', False)
+        retry_after = kwargs.get('RetryAfterSeconds')
         if (dont_delete):
             logging.info('We are NOT deleting the original SQS messages')
             return
+        scheduler = Scheduler(Clients=self.clients)
         for m in self.sqs_msgs:
-            scheduler = Scheduler()
             qm = QueuedMessage(QueuedMessage=m)
             logging.info("Setting messages InQueue to False")
             scheduler.update_queue_status(qm.uuid_key, qm.person_name, False)
-        self.delete_sqs_msgs()
+        if retry_after is None:
+            self.delete_sqs_msgs()
+        else:
+            logging.info('Retrying messages in {} seconds'
+                         .format(retry_after))
+            self.delete_sqs_msgs(VisibilityTimeout=retry_after)
 
     def succeed_messages(self, **kwargs):
         logging.info('Speech succeeded.')
@@ -182,7 +390,7 @@ class MessageManager(object):
             logging.info('We are NOT deleting the original SQS messages')
             return
 
-        scheduler = Scheduler()
+        scheduler = Scheduler(Clients=self.clients)
         for m in self.sqs_msgs:
             logging.info('Deleting message from queue')
             qm = QueuedMessage(QueuedMessage=m)
@@ -202,7 +410,11 @@ class MessageManager(object):
         self.fail_messages()
         self.delete_sqs_msgs()
 
-    def publish_message(self, **kwargs):
+    def build_message(self, **kwargs):
+        """validate publish arguments and build the SQS message
+
+        Returns whether the message belongs on the bot queue, the body and
+        the message attributes"""
         expiration_date = kwargs.pop('ExpirationDateTimeInUtc',
                                      '2299-12-31 00:00:00')
         body = kwargs.pop('Body', '')
@@ -213,6 +425,7 @@ class MessageManager(object):
         required_bots = kwargs.pop('RequiredBots', None)
         ice_breaker = kwargs.pop('IceBreaker', None)
         voice = kwargs.pop('VoiceId', 'Joanna')
+        windows = kwargs.pop('Windows', None)
         if not person_name:
             raise ValueError("No person provided")
         if not uuid_key:
@@ -222,9 +435,10 @@ class MessageManager(object):
         if kwargs:
             raise TypeError('Unexpected **kwargs: %r' % kwargs)
 
-        pm = PersonManager()
-        p = pm.get_person(person_name)
-        windows = p.time_windows.to_json()
+        if windows is None:
+            pm = PersonManager(Clients=self.clients)
+            p = pm.get_person(person_name)
+            windows = p.time_windows.to_json()
         msg_attr = {
             'PersonName': {
                 'StringValue': person_name,
@@ -268,7 +482,11 @@ class MessageManager(object):
                 'StringValue': ice_breaker,
                 'DataType': 'String'
             }
-        if bot_names:
+        return bool(bot_names), body, msg_attr
+
+    def publish_message(self, **kwargs):
+        is_bot, body, msg_attr = self.build_message(**kwargs)
+        if is_bot:
             self.log.debug('Publishing to bot queue')
             self.bot_queue.send_message(MessageBody=body,
                                         MessageAttributes=msg_attr)
@@ -278,14 +496,55 @@ class MessageManager(object):
                                     MessageAttributes=msg_attr)
         self.log.debug(body)
 
+    def publish_messages(self, messages):
+        """publish a list of publish_message argument dicts in batches
+
+        Returns one result dict per message, in the order given. A message
+        that can't be built fails on its own."""
+        windows = {}
+        entries = {'Bot': [], 'Message': []}
+        results = {}
+        for i, kwargs in enumerate(messages):
+            kwargs = dict(kwargs)
+            person_name = kwargs.get('PersonName', '')
+            try:
+                if 'Windows' not in kwargs and person_name:
+                    if person_name not in windows:
+                        pm = PersonManager(Clients=self.clients)
+                        p = pm.get_person(person_name)
+                        windows[person_name] = p.time_windows.to_json()
+                    kwargs['Windows'] = windows[person_name]
+                is_bot, body, msg_attr = self.build_message(**kwargs)
+            except Exception as e:
+                self.log.error('Unable to build message {}: {}'
+                               .format(kwargs.get('UUID'), e))
+                results[str(i)] = failed_result(e)
+                continue
+            entries['Bot' if is_bot else 'Message'].append({
+                'Id': str(i),
+                'MessageBody': body,
+                'MessageAttributes': msg_attr
+            })
+
+        if entries['Bot']:
+            self.log.debug('Publishing {} messages to bot queue'
+                           .format(len(entries['Bot'])))
+            results.update(send_batch(self.bot_queue, entries['Bot']))
+        if entries['Message']:
+            self.log.debug('Publishing {} messages to message queue'
+                           .format(len(entries['Message'])))
+            results.update(send_batch(self.queue, entries['Message']))
+        return [results[str(i)] for i in range(len(messages))]
+
 
 class LibraryManager(object):
-    def __init__(self):
+    def __init__(self, **kwargs):
+        self.clients = kwargs.get('Clients') or get_client_pool()
         validate_table(MESSAGE_LIBRARY_TABLE,
-                       self.create_message_library_table)
+                       self.create_message_library_table, self.clients)
 
     def create_message_library_table(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.create_table(
                     TableName=MESSAGE_LIBRARY_TABLE,
                     KeySchema=[
@@ -311,7 +570,7 @@ class LibraryManager(object):
     def update_message(self, **kwargs):
         name = kwargs.get('Name')
         message = kwargs.get('Message')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_LIBRARY_TABLE)
         table.put_item(
            Item={
@@ -322,7 +581,7 @@ class LibraryManager(object):
 
     def get_message(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_LIBRARY_TABLE)
         resp = table.get_item(
                 Key={
@@ -337,7 +596,7 @@ class LibraryManager(object):
 
     def delete_message(self, **kwargs):
         name = kwargs.get('Name')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_LIBRARY_TABLE)
         table.delete_item(
             Key={
@@ -0,0 +1,89 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+"""pacing and bookkeeping for threads that long-poll a queue"""
+import threading
+import time
+
+
+LONG_POLL_SECONDS = 20
+IDLE_BACKOFF_INITIAL_SECONDS = 1
+# long polls already keep an idle queue cheap; the rest only spaces them
+# out, so keep it short or it becomes delivery latency
+IDLE_BACKOFF_MAX_SECONDS = 4
+IDLE_BACKOFF_FACTOR = 2
+
+
+class IdleBackoff(object):
+    """how long a poller rests after each empty receive
+
+    The first empty receive goes straight back to polling; after that the
+    rest doubles from Initial up to Maximum. wake() cuts the current rest
+    short and starts again from nothing."""
+    def __init__(self, **kwargs):
+        self.initial = kwargs.get('Initial', IDLE_BACKOFF_INITIAL_SECONDS)
+        self.maximum = kwargs.get('Maximum', IDLE_BACKOFF_MAX_SECONDS)
+        self.factor = kwargs.get('Factor', IDLE_BACKOFF_FACTOR)
+        self.delay = 0
+        self.woken = threading.Event()
+
+    def reset(self):
+        self.delay = 0
+
+    def idle(self):
+        """rest after an empty receive and return the seconds rested"""
+        delay = self.delay
+        self.delay = min(max(delay * self.factor, self.initial),
+                         self.maximum)
+        if not delay:
+            return 0
+        started = time.time()
+        self.woken.wait(delay)
+        self.woken.clear()
+        return time.time() - started
+
+    def wake(self):
+        self.delay = 0
+        self.woken.set()
+
+
+class PollStats(object):
+    """counts of what a poller has done, safe to read from any thread"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.receives = 0
+        self.empty_receives = 0
+        self.messages = 0
+        self.idle_seconds = 0.0
+        self.wakeups = 0
+
+    def received(self, count):
+        with self.lock:
+            self.receives += 1
+            self.messages += count
+            if not count:
+                self.empty_receives += 1
+
+    def rested(self, seconds):
+        with self.lock:
+            self.idle_seconds += seconds
+
+    def woken(self):
+        with self.lock:
+            self.wakeups += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {'receives': self.receives,
+                    'empty_receives': self.empty_receives,
+                    'messages': self.messages,
+                    'idle_seconds': round(self.idle_seconds, 1),
+                    'wakeups': self.wakeups}
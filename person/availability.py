@@ -0,0 +1,106 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import arrow
+import math
+from datetime import timedelta
+from time_window import as_datetime
+
+
+DEFAULT_SLOT_MINUTES = 1
+DEFAULT_SLOTS = 60
+
+
+def window_mask(tw, start, slot, slots):
+    """a bitmask with bit i set when tw is open at start + i * slot"""
+    slot_seconds = slot.total_seconds()
+    end = start + slot * slots
+    mask = 0
+    for s in tw.rule.between(start - tw.delta, end, inc=True):
+        first = int(math.floor((s - start).total_seconds() /
+                               slot_seconds)) + 1
+        last = int(math.ceil((s + tw.delta - start).total_seconds() /
+                             slot_seconds)) - 1
+        first = max(first, 0)
+        last = min(last, slots - 1)
+        if first <= last:
+            mask |= ((1 << (last - first + 1)) - 1) << first
+    return mask
+
+
+class AvailabilityMatrix(object):
+    """availability of many people at each of their locations over a grid
+    of time slots
+
+    Each person/location pair is an int whose bits are the slots they can
+    be reached in, so questions about everyone at once are a handful of
+    bitwise ops rather than a rule search per window per person."""
+    def __init__(self, **kwargs):
+        start = as_datetime(kwargs.get('Start') or arrow.utcnow())
+        self.slot = timedelta(minutes=kwargs.get('SlotMinutes',
+                                                 DEFAULT_SLOT_MINUTES))
+        self.slots = kwargs.get('Slots', DEFAULT_SLOTS)
+        self.start = start.replace(second=0, microsecond=0)
+        self.masks = {}
+        self.priorities = {}
+        for p in kwargs.get('People', []):
+            self.add_person(p)
+
+    def add_person(self, person):
+        masks = self.masks.setdefault(person.name, {})
+        priorities = self.priorities.setdefault(person.name, {})
+        for tw in person.time_windows.set_list:
+            if tw.is_muted:
+                continue
+            ln = tw.location_name
+            masks[ln] = masks.get(ln, 0) | \
+                window_mask(tw, self.start, self.slot, self.slots)
+            priorities[ln] = max(priorities.get(ln, tw.priority),
+                                 tw.priority)
+
+    def slot_index(self, dt=None):
+        dt = as_datetime(dt or arrow.utcnow())
+        idx = int((dt - self.start).total_seconds() //
+                  self.slot.total_seconds())
+        if idx < 0 or idx >= self.slots:
+            raise ValueError('{} is outside of the availability grid'
+                             .format(dt.isoformat()))
+        return idx
+
+    def _locations(self, person_name, mask):
+        priorities = self.priorities.get(person_name, {})
+        locs = [ln for ln, m in self.masks.get(person_name, {}).items()
+                if m & mask]
+        return sorted(locs, key=lambda ln: (-priorities[ln], ln))
+
+    def _reachable(self, mask):
+        found = {}
+        for name in self.masks:
+            locs = self._locations(name, mask)
+            if locs:
+                found[name] = locs
+        return found
+
+    def reachable_at(self, dt=None):
+        """people who can be reached at dt and their locations, highest
+        priority first"""
+        return self._reachable(1 << self.slot_index(dt))
+
+    def reachable_within(self, minutes, dt=None):
+        """people who can be reached at some point in the next few minutes
+        and where"""
+        first = self.slot_index(dt)
+        count = int(math.ceil(minutes * 60 / self.slot.total_seconds()))
+        count = max(min(count, self.slots - first), 1)
+        return self._reachable(((1 << count) - 1) << first)
+
+    def locations(self, person_name, dt=None):
+        return self._locations(person_name, 1 << self.slot_index(dt))
@@ -9,16 +9,23 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
-import boto3
 import json
 import arrow
+import logging
+import random
+import time
 import yaml
 from time_window import TimeWindowSet, TimeWindow
 from boto3.dynamodb.conditions import Key
+from helpers.aws_clients import get_client_pool
+from helpers.db_helpers import scan_items
 
 
 PERSON_TABLE = 'PollexyPeople'
 PERSON_HASH_KEY = 'PersonName'
+BATCH_GET_SIZE = 100
+BATCH_GET_RETRIES = 5
+BATCH_GET_RETRY_DELAY_SECONDS = 0.05
 
 
 class PersonTimeWindow(TimeWindow):
@@ -34,11 +41,34 @@ class PersonTimeWindow(TimeWindow):
                 }
 
 
+class Availability(object):
+    """the unmuted windows a person is in at one moment, highest priority
+    first"""
+    def __init__(self, windows):
+        self.windows = windows
+
+    @property
+    def count(self):
+        return len(self.windows)
+
+    def pick(self, last_loc):
+        """round-robin to the window after last_loc, returning its index
+        and the window"""
+        if self.count == 0:
+            return None, None
+        if self.count > 1:
+            idx = (int(last_loc) + 1) % self.count
+        else:
+            idx = 0
+        return idx, self.windows[idx]
+
+
 class Person(object):
     def __init__(self, **kwargs):
         self.name = kwargs.get('Name', '')
-        self.time_windows = TimeWindowSet()
+        self.time_windows = TimeWindowSet(IntervalIndex=True)
         self.require_physical_confirmation = False
+        self._availability = None
 
     def add_windows(self, windows):
         for w in windows:
@@ -50,28 +80,38 @@ class Person(object):
 
     def add_window(self, w):
         self.time_windows.set_list.append(w)
+        self._availability = None
 
-    def all_available(self, dt=None):
+    def availability(self, dt=None):
+        """the person's Availability at dt, remembered until dt or the
+        windows change"""
         if not dt:
             dt = arrow.utcnow()
-        return sorted(self.time_windows.all_available(dt=dt),
-                      key=lambda a: a.priority,
-                      reverse=True)
+        if self._availability is None or self._availability[0] != dt:
+            windows = sorted(self.time_windows.all_available(dt=dt),
+                             key=lambda a: a.priority,
+                             reverse=True)
+            self._availability = (dt, Availability(windows))
+        return self._availability[1]
+
+    def all_available(self, dt=None):
+        return list(self.availability(dt).windows)
 
     def all_available_count(self, dt=None):
-        return sum(1 for _ in self.all_available(dt))
+        return self.availability(dt).count
 
     def remove_window_location(self, ln):
         self.time_windows.set_list = \
             filter(lambda w: w.location_name != ln, self.time_windows.set_list)
+        self._availability = None
 
 
 class PersonManager(object):
-    def __init__(self, *kwargs):
-        pass
+    def __init__(self, **kwargs):
+        self.clients = kwargs.get('Clients') or get_client_pool()
 
     def toggle_mute(self, person_name, is_muted=False):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(PERSON_TABLE)
         table.update_item(
             Key={
@@ -84,7 +124,7 @@ class PersonManager(object):
         )
 
     def update_window_set(self, person):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(PERSON_TABLE)
         table.update_item(
             Key={
@@ -120,7 +160,7 @@ class PersonManager(object):
         return p
 
     def delete(self, **kwargs):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         person_name = kwargs.get('PersonName')
         table = dynamodb.Table(PERSON_TABLE)
         table.delete_item(Key={
@@ -128,7 +168,7 @@ class PersonManager(object):
                 })
 
     def update_person(self, **kwargs):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         name = kwargs.get('Name')
         windows = kwargs.get('Windows')
         req_phys_conf = kwargs.get('RequirePhysicalConfirmation')
@@ -162,29 +202,50 @@ class PersonManager(object):
                 }
             )
 
+    def iter_all(self, **kwargs):
+        total_segments = kwargs.get('TotalSegments', 1)
+        for p in scan_items(PERSON_TABLE, TotalSegments=total_segments,
+                            Clients=self.clients):
+            yield self.convert_to_person(p)
+
     def get_all(self, **kwargs):
-        dynamodb_cl = boto3.client('dynamodb')
-        resp = dynamodb_cl.scan(
-            Select='ALL_ATTRIBUTES',
-            TableName=PERSON_TABLE,
-        )
-        people = []
-        if len(resp['Items']) == 0:
+        people = list(self.iter_all(**kwargs))
+        if len(people) == 0:
             return None
-        else:
-            for p in resp['Items']:
-                person = {}
-                if 'windows' in p.keys():
-                    person['windows'] = p['windows']['S']
-                if 'req_phys_confirm' in p.keys():
-                    person['req_phys_confirm'] = p['req_phys_confirm']['BOOL']
-                person['PersonName'] = p['PersonName']['S']
-                people.append(self.convert_to_person(person))
+        return people
 
+    def get_people(self, names):
+        """load several people at once, keyed by name; names that aren't
+        in the table are left out
+
+        Keys DynamoDB leaves unprocessed are retried up to BATCH_GET_RETRIES
+        times with a jittered, doubling delay, then left out as well."""
+        dynamodb = self.clients.resource('dynamodb')
+        names = list(set(names))
+        people = {}
+        for i in range(0, len(names), BATCH_GET_SIZE):
+            keys = [{PERSON_HASH_KEY: n} for n in names[i:i + BATCH_GET_SIZE]]
+            request = {PERSON_TABLE: {'Keys': keys}}
+            attempt = 0
+            while request:
+                response = dynamodb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(PERSON_TABLE, []):
+                    p = self.convert_to_person(item)
+                    people[p.name] = p
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                attempt += 1
+                if attempt > BATCH_GET_RETRIES:
+                    logging.error('Gave up loading {} people'.format(
+                        len(request[PERSON_TABLE]['Keys'])))
+                    break
+                time.sleep(random.uniform(
+                    0, BATCH_GET_RETRY_DELAY_SECONDS * 2 ** attempt))
         return people
 
     def get_person(self, name):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(PERSON_TABLE)
         response = table.query(
             Select='ALL_ATTRIBUTES',
@@ -193,3 +254,27 @@ class PersonManager(object):
             return None
         else:
             return self.convert_to_person(response['Items'][0])
+
+
+class PersonRepository(object):
+    """people looked up during a single scheduler tick
+
+    Everyone needed for the tick is fetched with one batch_get_item per
+    hundred names, and each Person is only parsed once."""
+    def __init__(self, **kwargs):
+        self.person_manager = kwargs.get('PersonManager') or \
+            PersonManager(Clients=kwargs.get('Clients'))
+        self.people = {}
+
+    def load(self, names):
+        missing = [n for n in set(names) if n not in self.people]
+        if not missing:
+            return
+        found = self.person_manager.get_people(missing)
+        for n in missing:
+            self.people[n] = found.get(n)
+
+    def get_person(self, name):
+        if name not in self.people:
+            self.load([name])
+        return self.people[name]
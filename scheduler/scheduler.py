@@ -9,15 +9,45 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
-import boto3
 import arrow
-from helpers.db_helpers import validate_table
+from boto3.dynamodb.conditions import Key
+from helpers.aws_clients import get_client_pool
+from helpers.db_helpers import validate_table, scan_items, scan_pages
 from datetime import datetime
 from messages.message import ScheduledMessage  # noqa: E402
 import logging
 import os
+import zlib
 
 MESSAGE_SCHEDULE_DB = 'PollexyMessageSchedule'
+DUE_INDEX = 'next_due_bucket-index'
+DUE_INDEX_BUCKETS = 4
+
+
+def due_bucket(uuid_key):
+    """spread messages across a fixed number of index partitions"""
+    return str((zlib.crc32(uuid_key) & 0xffffffff) % DUE_INDEX_BUCKETS)
+
+
+def is_finished(scheduled_message):
+    """True once a message has no occurrence left before its end time"""
+    next_occur = scheduled_message.next_occurrence_utc
+    if next_occur == 'N/A':
+        return True
+    end = scheduled_message.end_datetime_in_utc
+    return bool(end) and end <= arrow.get(next_occur)
+
+
+def due_index_attributes(scheduled_message):
+    """attributes that place a message in the due index, or None once the
+    message has no more occurrences"""
+    if is_finished(scheduled_message):
+        return None
+    next_occur = scheduled_message.next_occurrence_utc
+    return {
+        'next_due_bucket': due_bucket(scheduled_message.uuid_key),
+        'next_occurrence_utc': arrow.get(next_occur).to('utc').isoformat()
+    }
 
 
 def convert_to_scheduled_message(db_message):
@@ -39,78 +69,157 @@ def convert_to_scheduled_message(db_message):
         EndDateTimeInUtc=arrow.get(db_message["end_datetime_in_utc"])))
 
 
+def convert_to_db_item(scheduled_message):
+    item = {
+        'uuid': scheduled_message.uuid_key,
+        'create_time': datetime.utcnow().isoformat(),
+        'ical': scheduled_message.to_ical(),
+        'bot_names': scheduled_message.bot_names,
+        'required_bots': scheduled_message.required_bots,
+        'ice_breaker': scheduled_message.ice_breaker,
+        'person_name': scheduled_message.person_name,
+        'start_datetime_in_utc':
+            scheduled_message.start_datetime_in_utc.isoformat(),
+        'end_datetime_in_utc':
+            scheduled_message.end_datetime_in_utc.isoformat(),
+        'body': scheduled_message.body
+    }
+    due = due_index_attributes(scheduled_message)
+    if due:
+        item.update(due)
+    return item
+
+
 class Scheduler(object):
-    def __init__(self, *kwargs):
+    def __init__(self, **kwargs):
+        self.clients = kwargs.get('Clients') or get_client_pool()
         self.log = logging.getLogger("Scheduler")
         if os.environ.get('LOG_LEVEL') == 'DEBUG':
             self.log.setLevel(logging.DEBUG)
-        validate_table(MESSAGE_SCHEDULE_DB, self.create_schedule_table)
+        validate_table(MESSAGE_SCHEDULE_DB, self.create_schedule_table,
+                       self.clients)
 
     def schedule_message(self, scheduled_message):
-        datetime_in_utc = datetime.utcnow().isoformat()
-        ical = scheduled_message.to_ical()
-        body = scheduled_message.body
-        person_name = scheduled_message.person_name
-        end_datetime_in_utc = \
-            scheduled_message.end_datetime_in_utc.isoformat()
-        start_datetime_in_utc = \
-            scheduled_message.start_datetime_in_utc.isoformat()
-
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         logging.info('Storing message in ' + MESSAGE_SCHEDULE_DB)
-        table.put_item(
-           Item={
-               'uuid': scheduled_message.uuid_key,
-               'create_time': datetime_in_utc,
-               'ical': ical,
-               'bot_names': scheduled_message.bot_names,
-               'required_bots': scheduled_message.required_bots,
-               'ice_breaker': scheduled_message.ice_breaker,
-               'person_name': person_name,
-               'start_datetime_in_utc': start_datetime_in_utc,
-               'end_datetime_in_utc': end_datetime_in_utc,
-               'body': body
-            }
-        )
+        table.put_item(Item=convert_to_db_item(scheduled_message))
 
     def get_messages(self, compare_date='', ready_only=True, **kwargs):
         include_expired = kwargs.get('IncludeExpired', False)
+        use_due_index = kwargs.get('UseDueIndex', False)
+        total_segments = kwargs.get('TotalSegments', 1)
         self.log.debug("Checking for scheduled messages: compare_date={}," +
                        "ready_only={}".format(compare_date, bool(ready_only)))
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
-        response = table.scan(
-              Select='ALL_ATTRIBUTES'
-              )
         scheduled_messages = []
         if not compare_date:
             compare_date = arrow.utcnow()
             self.log.debug('Checking messages using uctnow since compare_dt ' +
                            'is empty, compare_date=%s'
                            % compare_date.isoformat())
-            self.log.debug("Total number of scheduled messages in table %s: %s"
-                           % (MESSAGE_SCHEDULE_DB, len(response['Items'])))
-        for item in response['Items']:
+        if use_due_index:
+            dynamodb = self.clients.resource('dynamodb')
+            table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+            items = self.get_due_items(table, compare_date)
+        else:
+            items = scan_items(MESSAGE_SCHEDULE_DB,
+                               TotalSegments=total_segments,
+                               Clients=self.clients)
+        item_count = 0
+        for item in items:
+            item_count += 1
             m = convert_to_scheduled_message(item)
+            if use_due_index and is_finished(m):
+                # the message ended without being expired, so stop reading
+                # it back on every tick
+                self.remove_from_due_index(table, item)
             if m.no_more_occurrences and not include_expired:
                 continue
-            self.log.debug('Message: {}'.format(m.body))
-            if not ready_only or (ready_only and
-                                  m.is_message_ready(
-                                      CompareDateTimeInUtc=compare_date)):
+            self.log.debug('Message: %s', m.body)
+            if not ready_only or m.is_message_ready(
+                    CompareDateTimeInUtc=compare_date):
                 self.log.debug('Adding message to response:')
-                scheduled_messages.append(convert_to_scheduled_message(item))
+                scheduled_messages.append(m)
             else:
-                self.log.debug('Skipping message, ready_only=%s, msg_rdy=%s'
-                               % (ready_only, m.is_message_ready(
-                                  CompareDateTimeInUtc=compare_date)))
+                self.log.debug('Skipping message, ready_only=%s, msg_rdy=%s',
+                               ready_only, False)
+        self.log.debug("Number of scheduled messages read from %s: %s"
+                       % (MESSAGE_SCHEDULE_DB, item_count))
         self.log.debug("Number of scheduled messages: %s"
                        % len(scheduled_messages))
         return scheduled_messages
 
+    def get_due_items(self, table, compare_date):
+        """query the due index for messages whose next occurrence is at or
+        before compare_date"""
+        due_by = arrow.get(compare_date).to('utc').isoformat()
+        for bucket in range(DUE_INDEX_BUCKETS):
+            query_args = {
+                'IndexName': DUE_INDEX,
+                'KeyConditionExpression':
+                    Key('next_due_bucket').eq(str(bucket)) &
+                    Key('next_occurrence_utc').lte(due_by)
+            }
+            while True:
+                response = table.query(**query_args)
+                for item in response['Items']:
+                    yield item
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_args['ExclusiveStartKey'] = \
+                    response['LastEvaluatedKey']
+
+    def reindex_messages(self):
+        """backfill the due index attributes on every scheduled message"""
+        dynamodb = self.clients.resource('dynamodb')
+        table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+        count = 0
+        for page in scan_pages(table):
+            for item in page['Items']:
+                if item.get('expired'):
+                    continue
+                self.update_due_index(table, item)
+                count += 1
+        return count
+
+    def update_due_index(self, table, item, last_occurrence=None):
+        try:
+            m = convert_to_scheduled_message(item)
+            if last_occurrence:
+                m.last_occurrence_in_utc = last_occurrence
+                m.compare_datetime_in_utc = last_occurrence.datetime
+            due = due_index_attributes(m)
+        except ValueError as e:
+            self.log.warn('Unable to compute next occurrence for {}: {}'
+                          .format(item['uuid'], e))
+            return
+        if not due:
+            self.remove_from_due_index(table, item)
+            return
+        table.update_item(
+            Key={
+                'uuid': item['uuid'],
+                'person_name': item['person_name']
+            },
+            UpdateExpression='SET next_due_bucket=:b, '
+                             'next_occurrence_utc=:no',
+            ExpressionAttributeValues={
+                ':b': due['next_due_bucket'],
+                ':no': due['next_occurrence_utc']
+            }
+        )
+
+    def remove_from_due_index(self, table, item):
+        table.update_item(
+            Key={
+                'uuid': item['uuid'],
+                'person_name': item['person_name']
+            },
+            UpdateExpression='REMOVE next_due_bucket, next_occurrence_utc'
+        )
+
     def create_schedule_table(self):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.create_table(
                     TableName=MESSAGE_SCHEDULE_DB,
                     KeySchema=[
@@ -132,6 +241,36 @@ class Scheduler(object):
                             'AttributeName': 'person_name',
                             'AttributeType': 'S'
                         },
+                        {
+                            'AttributeName': 'next_due_bucket',
+                            'AttributeType': 'S'
+                        },
+                        {
+                            'AttributeName': 'next_occurrence_utc',
+                            'AttributeType': 'S'
+                        },
+                    ],
+                    GlobalSecondaryIndexes=[
+                        {
+                            'IndexName': DUE_INDEX,
+                            'KeySchema': [
+                                {
+                                    'AttributeName': 'next_due_bucket',
+                                    'KeyType': 'HASH'
+                                },
+                                {
+                                    'AttributeName': 'next_occurrence_utc',
+                                    'KeyType': 'RANGE'
+                                }
+                            ],
+                            'Projection': {
+                                'ProjectionType': 'ALL'
+                            },
+                            'ProvisionedThroughput': {
+                                'ReadCapacityUnits': 1,
+                                'WriteCapacityUnits': 1,
+                            }
+                        }
                     ],
                     ProvisionedThroughput={
                         'ReadCapacityUnits': 1,
@@ -142,7 +281,7 @@ class Scheduler(object):
             .wait(TableName=MESSAGE_SCHEDULE_DB)
 
     def update_last_location(self, uuid, person_name, last_loc=0):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         table.update_item(
             Key={
@@ -156,7 +295,7 @@ class Scheduler(object):
         )
 
     def update_queue_status(self, uuid, person_name, is_queued=True):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         self.log.debug('Marking message in queue')
         table.update_item(
@@ -171,14 +310,18 @@ class Scheduler(object):
         )
 
     def set_expired(self, uuid, person_name, is_expired=True):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+        upd_expr = 'SET expired=:lo'
+        if is_expired:
+            # expired messages drop out of the due index
+            upd_expr += ' REMOVE next_due_bucket, next_occurrence_utc'
         table.update_item(
             Key={
                 'uuid': uuid,
                 'person_name': person_name
             },
-            UpdateExpression='SET expired=:lo',
+            UpdateExpression=upd_expr,
             ExpressionAttributeValues={
                 ':lo': is_expired
             }
@@ -187,7 +330,7 @@ class Scheduler(object):
     def delete_message(self, **kwargs):
         key = kwargs.get('Key')
         name = kwargs.get('PersonName')
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         table.delete_item(
             Key={
@@ -197,11 +340,11 @@ class Scheduler(object):
         )
 
     def update_last_occurrence(self, uuid, person_name, last_occurrence=None):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         if not last_occurrence:
             last_occurrence = arrow.utcnow()
-        table.update_item(
+        response = table.update_item(
             Key={
                 'uuid': uuid,
                 'person_name': person_name
@@ -209,8 +352,12 @@ class Scheduler(object):
             UpdateExpression='SET last_occurrence_in_utc=:lo',
             ExpressionAttributeValues={
                 ':lo': last_occurrence.isoformat()
-            }
+            },
+            ReturnValues='ALL_NEW'
         )
+        if 'start_datetime_in_utc' in response.get('Attributes', {}):
+            self.update_due_index(table, response['Attributes'],
+                                  last_occurrence)
 
     def update_tried_locations(self, **kwargs):
         uuid = kwargs.get('UUID')
@@ -222,7 +369,7 @@ class Scheduler(object):
 
         current_locations.append(location_name)
 
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = self.clients.resource('dynamodb')
         table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
         table.update_item(
             Key={
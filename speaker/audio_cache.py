@@ -0,0 +1,117 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+AUDIO_CACHE_FOLDER = os.path.expanduser("~/.pollexy/.cache/audio")
+AUDIO_CACHE_MAX_BYTES = 200 * 1024 * 1024
+FILE_EXTENSIONS = {'ogg_vorbis': '.ogg', 'mp3': '.mp3', 'pcm': '.pcm'}
+
+_audio_cache = None
+_audio_cache_lock = threading.Lock()
+
+
+def audio_cache_key(text, text_type, voice, output_format):
+    key = json.dumps([text, text_type, voice, output_format])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class AudioCache(object):
+    """synthesized speech on disk, named by a hash of everything that went
+    into synthesizing it
+
+    Files are evicted least recently used first (by mtime, which a hit
+    refreshes) once the folder grows past MaxBytes."""
+    def __init__(self, **kwargs):
+        self.folder = kwargs.get('CacheFolder', AUDIO_CACHE_FOLDER)
+        self.max_bytes = kwargs.get('MaxBytes', AUDIO_CACHE_MAX_BYTES)
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        try:
+            os.makedirs(self.folder)
+        except OSError:
+            if not os.path.isdir(self.folder):
+                raise
+
+    def path_for(self, key, output_format):
+        return os.path.join(self.folder,
+                            key + FILE_EXTENSIONS.get(output_format, ''))
+
+    def get(self, text, text_type, voice, output_format):
+        """the cached file's path, or None"""
+        key = audio_cache_key(text, text_type, voice, output_format)
+        path = self.path_for(key, output_format)
+        try:
+            os.utime(path, None)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return path
+
+    def put(self, text, text_type, voice, output_format, stream):
+        """store the audio read from stream and return its path"""
+        key = audio_cache_key(text, text_type, voice, output_format)
+        path = self.path_for(key, output_format)
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(64 * 1024), b''):
+                    f.write(chunk)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+        return path
+
+    def evict(self):
+        files = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.folder, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(f[1] for f in files)
+        for mtime, size, path in sorted(files)[:-1]:
+            if total <= self.max_bytes:
+                break
+            logging.debug('Evicting %s from the audio cache' % path)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+
+def get_audio_cache():
+    global _audio_cache
+    with _audio_cache_lock:
+        if _audio_cache is None:
+            _audio_cache = AudioCache()
+        return _audio_cache
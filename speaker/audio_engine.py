@@ -0,0 +1,195 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import audioop
+import glob
+import logging
+import os
+import threading
+import Queue
+import pygame
+from ring_buffer import STREAM_CHUNK_BYTES
+
+
+MIXER_FREQUENCY = 44100
+MIXER_SIZE = -16
+MIXER_CHANNELS = 2
+MIXER_BUFFER = 2048
+POLL_MILLISECONDS = 5
+
+_audio_engine = None
+_audio_engine_lock = threading.Lock()
+
+
+class Playback(object):
+    """a queued play request; wait() blocks until it has finished"""
+    def __init__(self, sounds, callback):
+        self.sounds = sounds
+        self.callback = callback
+        self.error = None
+        self.done = threading.Event()
+
+    def wait(self, timeout=None):
+        self.done.wait(timeout)
+        return self.done.is_set()
+
+
+class AudioEngine(object):
+    """one open audio device for the life of the process
+
+    Chimes are kept in memory and every request is played back to back on
+    a single mixer channel by a worker thread, so play() returns at once
+    and the caller can get on with fetching the next message."""
+    def __init__(self, **kwargs):
+        self.chime_path = kwargs.get(
+            'ChimePath', os.path.expanduser("~/.pollexy/.cache/chimes"))
+        pygame.mixer.pre_init(MIXER_FREQUENCY, MIXER_SIZE, MIXER_CHANNELS,
+                              MIXER_BUFFER)
+        pygame.init()
+        pygame.mixer.init()
+        self.frequency, _, self.channels = pygame.mixer.get_init()
+        self.channel = pygame.mixer.Channel(0)
+        self.chimes = {}
+        self.chimes_lock = threading.Lock()
+        self.load_chimes()
+        self.requests = Queue.Queue()
+        self.stopped = False
+        self.stop_lock = threading.Lock()
+        self.worker = threading.Thread(target=self._play_requests)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def load_chimes(self):
+        for path in glob.glob(os.path.join(self.chime_path, '*.wav')):
+            name = os.path.splitext(os.path.basename(path))[0]
+            with self.chimes_lock:
+                self.chimes[name] = pygame.mixer.Sound(path)
+
+    def chime(self, name):
+        with self.chimes_lock:
+            if name not in self.chimes:
+                logging.info('chime={}/{}.wav'.format(self.chime_path, name))
+                self.chimes[name] = pygame.mixer.Sound(
+                    "%s/%s.wav" % (self.chime_path, name))
+            return self.chimes[name]
+
+    def play(self, sounds, **kwargs):
+        """queue sounds to play one after another and return a Playback
+
+        sounds may be a generator; it is consumed on the worker thread
+        while the previous sound is playing."""
+        chime = kwargs.get('Chime')
+        if chime:
+            sounds = self._chain([self.chime(chime)], sounds)
+        playback = Playback(sounds, kwargs.get('Callback'))
+        with self.stop_lock:
+            if not self.stopped:
+                self.requests.put(playback)
+                return playback
+        playback.error = RuntimeError('audio engine is stopped')
+        playback.done.set()
+        if playback.callback:
+            playback.callback(playback)
+        return playback
+
+    def stop(self, **kwargs):
+        """finish what is queued, then stop the worker and the mixer"""
+        with self.stop_lock:
+            self.stopped = True
+            self.requests.put(None)
+        self.worker.join(kwargs.get('Timeout', 5))
+        if self.worker.is_alive():
+            logging.warning('Audio engine did not stop in time')
+            return False
+        self.channel.stop()
+        pygame.mixer.quit()
+        return True
+
+    def sound(self, path):
+        return pygame.mixer.Sound(path)
+
+    def play_file(self, path, **kwargs):
+        return self.play([self.sound(path)], **kwargs)
+
+    def play_pcm(self, rings, sample_rate, **kwargs):
+        """play 16 bit mono PCM as it is read from each RingBuffer in turn"""
+        return self.play(self._pcm_chain(rings, sample_rate), **kwargs)
+
+    def _chain(self, *iterables):
+        for it in iterables:
+            for s in it:
+                yield s
+
+    def _pcm_chain(self, rings, sample_rate):
+        for ring in rings:
+            for s in self._pcm_sounds(ring, sample_rate):
+                yield s
+
+    def _pcm_sounds(self, ring, sample_rate):
+        state = None
+        leftover = b''
+        try:
+            for data in iter(lambda: ring.read(STREAM_CHUNK_BYTES), b''):
+                # samples are 16 bit, so never split one across chunks
+                data = leftover + data
+                cut = len(data) - len(data) % 2
+                data, leftover = data[:cut], data[cut:]
+                if not data:
+                    continue
+                if sample_rate != self.frequency:
+                    data, state = audioop.ratecv(data, 2, 1, sample_rate,
+                                                 self.frequency, state)
+                if self.channels == 2:
+                    data = audioop.tostereo(data, 2, 1, 1)
+                yield pygame.mixer.Sound(buffer=data)
+        finally:
+            ring.close()
+
+    def _play_requests(self):
+        while True:
+            playback = self.requests.get()
+            if playback is None:
+                break
+            try:
+                for sound in playback.sounds:
+                    if not self.channel.get_busy():
+                        self.channel.play(sound)
+                        continue
+                    while self.channel.get_queue() is not None:
+                        pygame.time.wait(POLL_MILLISECONDS)
+                    self.channel.queue(sound)
+                while self.channel.get_busy():
+                    pygame.time.wait(POLL_MILLISECONDS)
+            except Exception as e:
+                logging.exception('Playback failed')
+                playback.error = e
+            playback.done.set()
+            if playback.callback:
+                try:
+                    playback.callback(playback)
+                except Exception:
+                    logging.exception('Playback callback failed')
+
+
+def get_audio_engine(**kwargs):
+    global _audio_engine
+    with _audio_engine_lock:
+        if _audio_engine is None:
+            _audio_engine = AudioEngine(**kwargs)
+        return _audio_engine
+
+
+def stop_audio_engine(**kwargs):
+    global _audio_engine
+    with _audio_engine_lock:
+        engine, _audio_engine = _audio_engine, None
+    if engine is not None:
+        engine.stop(**kwargs)
@@ -0,0 +1,161 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import logging
+import sys
+import threading
+import Queue
+from messages.message_manager import MessageManager
+from messages.polling import IdleBackoff, PollStats, LONG_POLL_SECONDS, \
+    IDLE_BACKOFF_MAX_SECONDS
+from location_player import LocationPlayer, QUEUE_POLL_SECONDS, \
+    VISIBILITY_TIMEOUT_SECONDS
+
+
+class BotJob(object):
+    """bot conversations received for a person, to be held in order"""
+    def __init__(self, **kwargs):
+        self.message_manager = kwargs.get('MessageManager')
+        self.bots = kwargs.get('Bots', [])
+
+
+class LocationAgent(object):
+    """serves one person's bot and message queues at a location
+
+    Both queues are long-polled at once on their own threads, each resting
+    for longer and longer while its queue stays empty. New motion at the
+    location, seen through check_motion(), wakes both pollers at once, so
+    a quiet room costs a few requests a minute instead of a steady stream.
+    Bot jobs are held by the player like its own jobs, so their messages
+    stay hidden until they are succeeded.
+    """
+    def __init__(self, **kwargs):
+        self.person_name = kwargs.get('PersonName')
+        self.location_name = kwargs.get('LocationName')
+        self.dont_delete = kwargs.get('DontDelete', False)
+        self.wait_time_seconds = kwargs.get('WaitTimeSeconds',
+                                            LONG_POLL_SECONDS)
+        max_idle = kwargs.get('MaxIdleSeconds', IDLE_BACKOFF_MAX_SECONDS)
+        self.backoffs = {'Bot': IdleBackoff(Maximum=max_idle),
+                         'Message': IdleBackoff(Maximum=max_idle)}
+        self.poll_stats = {'Bot': PollStats(), 'Message': PollStats()}
+        self.player = LocationPlayer(PersonName=self.person_name,
+                                     LocationName=self.location_name,
+                                     VoiceId=kwargs.get('VoiceId'),
+                                     NoAudio=kwargs.get('NoAudio', False),
+                                     Streaming=kwargs.get('Streaming', False),
+                                     DontDelete=self.dont_delete,
+                                     WaitTimeSeconds=self.wait_time_seconds,
+                                     Backoff=self.backoffs['Message'],
+                                     Stats=self.poll_stats['Message'])
+        self.bot_jobs = Queue.Queue()
+        self.stopping = threading.Event()
+        self.exc_info = None
+        self.last_activity = None
+        self.threads = []
+
+    def start(self):
+        t = threading.Thread(target=self._poll_bots)
+        t.daemon = True
+        t.start()
+        self.threads.append(t)
+        self.player.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wake()
+        self.player.stop()
+        for t in self.threads:
+            t.join()
+        while True:
+            try:
+                job = self.bot_jobs.get_nowait()
+            except Queue.Empty:
+                break
+            self.player.release(job)
+            job.message_manager.delete_sqs_msgs(VisibilityTimeout=0)
+
+    def wake(self):
+        """cut any idle rest short and poll both queues now"""
+        for name, backoff in self.backoffs.items():
+            self.poll_stats[name].woken()
+            backoff.wake()
+
+    def check_motion(self, location):
+        """wake the pollers if location shows motion not seen before"""
+        last_activity = getattr(location, 'last_activity', None)
+        if last_activity == self.last_activity:
+            return False
+        self.last_activity = last_activity
+        if not location.is_motion:
+            return False
+        logging.debug('Motion at {}, waking pollers'
+                      .format(self.location_name))
+        self.wake()
+        return True
+
+    def next_bot_job(self, **kwargs):
+        """the next BotJob, or None if none arrives within Timeout seconds
+        (by default, don't wait at all)"""
+        timeout = kwargs.get('Timeout')
+        try:
+            if timeout:
+                return self.bot_jobs.get(timeout=timeout)
+            return self.bot_jobs.get_nowait()
+        except Queue.Empty:
+            pass
+        if self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return None
+
+    def succeed_bot_job(self, job):
+        self.player.release(job)
+        job.message_manager.succeed_messages(DontDelete=self.dont_delete)
+
+    def next_job(self, **kwargs):
+        return self.player.next_job(
+            Timeout=kwargs.get('Timeout', QUEUE_POLL_SECONDS))
+
+    def succeed(self, job):
+        self.player.succeed(job)
+
+    def fail(self, job, reason):
+        self.player.fail(job, reason)
+
+    def stats(self):
+        return dict((name, s.as_dict())
+                    for name, s in self.poll_stats.items())
+
+    def _poll_bots(self):
+        stats = self.poll_stats['Bot']
+        backoff = self.backoffs['Bot']
+        try:
+            while not self.stopping.is_set():
+                mm = MessageManager(LocationName=self.location_name)
+                bots = mm.get_messages(
+                    MessageType='Bot',
+                    PersonName=self.person_name,
+                    WaitTimeSeconds=self.wait_time_seconds,
+                    VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS)
+                stats.received(len(bots))
+                if not bots:
+                    stats.rested(backoff.idle())
+                    continue
+                backoff.reset()
+                if self.stopping.is_set():
+                    mm.delete_sqs_msgs(VisibilityTimeout=0)
+                    break
+                job = BotJob(MessageManager=mm, Bots=bots)
+                self.player.hold(job)
+                self.bot_jobs.put(job)
+        except Exception:
+            logging.exception('Polling for bots failed')
+            self.exc_info = sys.exc_info()
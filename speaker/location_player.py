@@ -0,0 +1,215 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import logging
+import sys
+import threading
+import time
+import Queue
+from messages.message_manager import MessageManager
+from messages.polling import PollStats
+from speaker import Speaker
+
+
+PREFETCH_JOBS = 1
+RECEIVE_WAIT_SECONDS = 5
+QUEUE_POLL_SECONDS = 0.5
+VISIBILITY_TIMEOUT_SECONDS = 120
+VISIBILITY_RENEW_SECONDS = 30
+
+
+class SpeechJob(object):
+    """one person's pending speech at a location, ready to play"""
+    def __init__(self, **kwargs):
+        self.message_manager = kwargs.get('MessageManager')
+        self.speaker = kwargs.get('Speaker')
+        self.speech = kwargs.get('Speech')
+        self.voice_id = kwargs.get('VoiceId')
+
+
+class LocationPlayer(object):
+    """keeps the next message synthesized while the current one plays
+
+    A fetch thread receives a person's messages, builds the speech and
+    synthesizes it into a bounded queue of SpeechJobs; an acknowledgement
+    thread succeeds or fails jobs once they have been played. The caller
+    only takes jobs with next_job(), plays them and hands them back.
+    With a Backoff the fetch thread rests after receives that find
+    nothing.
+
+    Jobs are received with VisibilityTimeout and, until they are
+    acknowledged, the acknowledgement thread hides their messages again
+    every RenewSeconds. However long a job waits to be played, or is held
+    up by playback and conversations, it is never received twice."""
+    def __init__(self, **kwargs):
+        self.person_name = kwargs.get('PersonName')
+        self.location_name = kwargs.get('LocationName')
+        self.voice_id = kwargs.get('VoiceId')
+        self.no_audio = kwargs.get('NoAudio', False)
+        self.streaming = kwargs.get('Streaming', False)
+        self.dont_delete = kwargs.get('DontDelete', False)
+        self.wait_time_seconds = kwargs.get('WaitTimeSeconds',
+                                            RECEIVE_WAIT_SECONDS)
+        self.backoff = kwargs.get('Backoff')
+        self.stats = kwargs.get('Stats') or PollStats()
+        self.ready = Queue.Queue(maxsize=kwargs.get('Prefetch',
+                                                    PREFETCH_JOBS))
+        self.visibility_timeout = kwargs.get('VisibilityTimeout',
+                                             VISIBILITY_TIMEOUT_SECONDS)
+        self.renew_seconds = kwargs.get('RenewSeconds',
+                                        VISIBILITY_RENEW_SECONDS)
+        self.held = []
+        self.held_lock = threading.Lock()
+        self.done = Queue.Queue()
+        self.stopping = threading.Event()
+        self.exc_info = None
+        self.threads = []
+
+    def start(self):
+        for target in [self._fetch, self._acknowledge]:
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def stop(self):
+        """stop fetching, finish acknowledgements and put back anything
+        fetched but never played"""
+        self.stopping.set()
+        self.done.put(None)
+        for t in self.threads:
+            t.join()
+        while True:
+            try:
+                job = self.ready.get_nowait()
+            except Queue.Empty:
+                break
+            self.release(job)
+            job.message_manager.delete_sqs_msgs(VisibilityTimeout=0)
+            job.speaker.cleanup()
+
+    def next_job(self, **kwargs):
+        """the next SpeechJob, or None if none is ready within Timeout
+        seconds"""
+        try:
+            job = self.ready.get(timeout=kwargs.get('Timeout',
+                                                    QUEUE_POLL_SECONDS))
+        except Queue.Empty:
+            job = None
+        if job is None and self.exc_info:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return job
+
+    def succeed(self, job):
+        self.done.put((job, None))
+
+    def fail(self, job, reason):
+        self.done.put((job, reason))
+
+    def hold(self, job):
+        """keep job's messages hidden until release()"""
+        with self.held_lock:
+            self.held.append(job)
+
+    def release(self, job):
+        with self.held_lock:
+            if job in self.held:
+                self.held.remove(job)
+
+    def renew(self):
+        with self.held_lock:
+            held = list(self.held)
+        for job in held:
+            try:
+                job.message_manager.hold_sqs_msgs(
+                    VisibilityTimeout=self.visibility_timeout)
+            except Exception:
+                logging.exception('Renewing message visibility failed')
+
+    def _fetch(self):
+        try:
+            while not self.stopping.is_set():
+                job = self.fetch_job()
+                if not job:
+                    if self.backoff:
+                        self.stats.rested(self.backoff.idle())
+                    continue
+                if self.backoff:
+                    self.backoff.reset()
+                if not self._hand_off(job):
+                    self.release(job)
+                    job.message_manager.delete_sqs_msgs(VisibilityTimeout=0)
+                    job.speaker.cleanup()
+        except Exception:
+            logging.exception('Fetching messages failed')
+            self.exc_info = sys.exc_info()
+
+    def _hand_off(self, job):
+        while not self.stopping.is_set():
+            try:
+                self.ready.put(job, timeout=QUEUE_POLL_SECONDS)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def fetch_job(self):
+        mm = MessageManager(LocationName=self.location_name)
+        vid, speech = mm.write_speech(
+            PersonName=self.person_name,
+            WaitTimeSeconds=self.wait_time_seconds,
+            VisibilityTimeout=self.visibility_timeout)
+        self.stats.received(len(mm.sqs_msgs))
+        if not speech:
+            # nothing left to say, but expired messages still get cleared
+            if mm.sqs_msgs:
+                mm.succeed_messages(DontDelete=self.dont_delete)
+            return None
+        job = SpeechJob(MessageManager=mm, Speech=speech)
+        self.hold(job)
+        try:
+            speaker = Speaker(NoAudio=self.no_audio, Streaming=self.streaming)
+            voice_id = vid or self.voice_id or speaker.voice
+            speaker.generate_audio(Message=speech,
+                                   TextType='ssml',
+                                   VoiceId=voice_id)
+        except Exception:
+            self.release(job)
+            raise
+        job.speaker = speaker
+        job.voice_id = voice_id
+        return job
+
+    def _acknowledge(self):
+        renewed = time.time()
+        while True:
+            if time.time() - renewed >= self.renew_seconds:
+                self.renew()
+                renewed = time.time()
+            try:
+                item = self.done.get(timeout=self.renew_seconds)
+            except Queue.Empty:
+                continue
+            if item is None:
+                return
+            job, reason = item
+            self.release(job)
+            try:
+                if reason:
+                    job.message_manager.fail_messages(
+                        Reason=reason, DontDelete=self.dont_delete)
+                else:
+                    job.message_manager.succeed_messages(
+                        DontDelete=self.dont_delete)
+            except Exception:
+                logging.exception('Acknowledging messages failed')
+            finally:
+                job.speaker.cleanup()
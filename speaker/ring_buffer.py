@@ -0,0 +1,88 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import sys
+import threading
+
+
+RING_BUFFER_BYTES = 256 * 1024
+STREAM_CHUNK_BYTES = 4096
+
+
+class RingBuffer(object):
+    """a fixed size byte buffer between one writer thread and one reader
+
+    write() blocks while the buffer is full and read() blocks while it is
+    empty, until close() is called. An exception raised while filling the
+    buffer is re-raised to the reader."""
+    def __init__(self, capacity=RING_BUFFER_BYTES):
+        self.buf = bytearray(capacity)
+        self.capacity = capacity
+        self.head = 0
+        self.size = 0
+        self.closed = False
+        self.exc_info = None
+        self.cond = threading.Condition()
+
+    def write(self, data):
+        data = bytearray(data)
+        while data:
+            with self.cond:
+                while self.size == self.capacity and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    raise ValueError('write to a closed ring buffer')
+                count = min(len(data), self.capacity - self.size)
+                tail = (self.head + self.size) % self.capacity
+                first = min(count, self.capacity - tail)
+                self.buf[tail:tail + first] = data[:first]
+                self.buf[:count - first] = data[first:count]
+                self.size += count
+                self.cond.notify_all()
+            data = data[count:]
+
+    def read(self, n):
+        """up to n bytes, or an empty string once closed and drained"""
+        with self.cond:
+            while self.size == 0 and not self.closed:
+                self.cond.wait()
+            if self.size == 0 and self.exc_info:
+                raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+            count = min(n, self.size)
+            first = min(count, self.capacity - self.head)
+            data = bytes(self.buf[self.head:self.head + first] +
+                         self.buf[:count - first])
+            self.head = (self.head + count) % self.capacity
+            self.size -= count
+            self.cond.notify_all()
+            return data
+
+    def close(self, exc_info=None):
+        with self.cond:
+            self.closed = True
+            self.exc_info = exc_info
+            self.cond.notify_all()
+
+    def fill(self, stream, chunk_size=STREAM_CHUNK_BYTES):
+        """copy stream into the buffer until it ends, then close"""
+        try:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                self.write(chunk)
+        except Exception:
+            self.close(sys.exc_info())
+            return
+        self.close()
+
+    def start_filling(self, stream, chunk_size=STREAM_CHUNK_BYTES):
+        t = threading.Thread(target=self.fill, args=(stream, chunk_size))
+        t.daemon = True
+        t.start()
+        return t
@@ -9,12 +9,30 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
-import boto3
-import pygame
 from contextlib import closing
+from multiprocessing.pool import ThreadPool
 import tempfile
 import os
-import logging
+import threading
+from helpers.aws_clients import get_client_pool
+from helpers.speech import split_ssml
+from audio_cache import get_audio_cache
+from ring_buffer import RingBuffer
+from audio_engine import get_audio_engine
+
+PCM_SAMPLE_RATE = 16000
+SYNTHESIS_THREADS = 4
+
+_synthesis_pool = None
+_synthesis_pool_lock = threading.Lock()
+
+
+def get_synthesis_pool():
+    global _synthesis_pool
+    with _synthesis_pool_lock:
+        if _synthesis_pool is None:
+            _synthesis_pool = ThreadPool(SYNTHESIS_THREADS)
+        return _synthesis_pool
 
 
 class Speaker(object):
@@ -24,8 +42,18 @@ class Speaker(object):
         self.chime_path = kwargs.pop("ChimePath",
                                      os.path.expanduser("~/.pollexy/.cache/chimes"))
         self.no_audio = kwargs.pop("NoAudio", False)
+        self.streaming = kwargs.pop("Streaming", False)
+        self.clients = kwargs.pop("Clients", None) or get_client_pool()
+        if kwargs.pop("UseAudioCache", True):
+            self.audio_cache = kwargs.pop("AudioCache", None) or \
+                get_audio_cache()
+        else:
+            self.audio_cache = None
         self.is_audio_ready = False
+        self.is_cached_audio = False
         self.audio_file_path = ""
+        self.audio_parts = None
+        self.audio_part_paths = []
 
     def just_say(self, **kwargs):
         include_chime = kwargs.pop('IncludeChime', False)
@@ -40,25 +68,57 @@ class Speaker(object):
         voice = kwargs.pop("VoiceId", self.voice).capitalize()
         if not message:
             return
-        if not self.no_audio:
-            polly = boto3.client('polly')
-            response = polly.synthesize_speech(
-                Text=message,
-                OutputFormat="ogg_vorbis",
-                TextType=text_type,
-                VoiceId=voice)
+        if text_type == 'ssml':
+            self.chunks = split_ssml(message)
+        else:
+            self.chunks = [message]
+        if self.streaming:
+            self.text_type = text_type
+            self.voice_id = voice
+        elif not self.no_audio:
+            self.is_cached_audio = self.audio_cache is not None
+            if len(self.chunks) == 1:
+                self.audio_file_path = self.synthesize(message, text_type,
+                                                       voice)
+            else:
+                # chunks are synthesized in parallel and come back in
+                # order, so playback can start with the first one
+                self.audio_parts = get_synthesis_pool().imap(
+                    lambda c: self.synthesize(c, text_type, voice),
+                    self.chunks)
+        self.message = message
+        self.is_audio_ready = True
 
-            fd, path = tempfile.mkstemp(suffix=".ogg")
+    def synthesize(self, message, text_type, voice):
+        output_format = "ogg_vorbis"
+        if self.audio_cache is not None:
+            path = self.audio_cache.get(message, text_type, voice,
+                                        output_format)
+            if path:
+                return path
 
-            with closing(response["AudioStream"]) as stream:
-                with open(path, 'wb') as file:
-                    file.write(stream.read())
+        polly = self.clients.client('polly')
+        response = polly.synthesize_speech(
+            Text=message,
+            OutputFormat=output_format,
+            TextType=text_type,
+            VoiceId=voice)
 
-            self.audio_file_path = path
-        self.message = message
-        self.is_audio_ready = True
+        with closing(response["AudioStream"]) as stream:
+            if self.audio_cache is not None:
+                return self.audio_cache.put(message, text_type, voice,
+                                            output_format, stream)
+            fd, path = tempfile.mkstemp(suffix=".ogg")
+            with os.fdopen(fd, 'wb') as file:
+                file.write(stream.read())
+        return path
 
     def speak(self, **kwargs):
+        """play the generated audio through the process's AudioEngine
+
+        Blocks until playback is done unless Wait=False, in which case the
+        Playback is returned and Callback(playback) is called when it
+        finishes."""
         include_chime = kwargs.get('IncludeChime', False)
         chime = kwargs.pop("Chime", "three_tone_chime")
         if not self.is_audio_ready:
@@ -67,26 +127,72 @@ class Speaker(object):
         if self.no_audio:
             print "No audio . . . speech would be:\n%s" % self.message
             return "audio: %s"
+        engine = get_audio_engine(ChimePath=self.chime_path)
+        chime = chime if include_chime else None
+        callback = kwargs.pop('Callback', None)
+        audio_file_to_play = kwargs.pop("AudioFilePath", None)
+        if self.streaming:
+            playback = engine.play_pcm(self.open_pcm_streams(),
+                                       PCM_SAMPLE_RATE,
+                                       Chime=chime, Callback=callback)
+        elif not audio_file_to_play and self.audio_parts is not None:
+            playback = engine.play(self.part_sounds(engine),
+                                   Chime=chime, Callback=callback)
         else:
-            audio_file_to_play = kwargs.pop("AudioFilePath",
-                                            self.audio_file_path)
-            pygame.mixer.pre_init(44100, -16, 2, 2048)
-            pygame.init()
-            pygame.mixer.init()
-            if (include_chime):
-                logging.info('chime={}/{}.wav'.format(self.chime_path, chime))
-                pygame.mixer.music.load("%s/%s.wav" % (self.chime_path, chime))
-                pygame.mixer.music.play()
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
-            pygame.mixer.music.load(audio_file_to_play)
-            pygame.mixer.music.play(1)
-            while pygame.mixer.music.get_busy():
-                pygame.time.Clock().tick(10)
+            playback = engine.play_file(
+                audio_file_to_play or self.audio_file_path,
+                Chime=chime, Callback=callback)
+        if kwargs.pop('Wait', True):
+            playback.wait()
+            if playback.error:
+                raise playback.error
+        return playback
+
+    def part_sounds(self, engine):
+        for path in self.audio_parts:
+            self.audio_part_paths.append(path)
+            yield engine.sound(path)
+
+    def open_pcm_streams(self):
+        """RingBuffers being filled with PCM as Polly synthesizes each
+        chunk; the next chunk is requested before the current one is
+        handed over"""
+        pending = None
+        for chunk in self.chunks:
+            ring = self.open_pcm_stream(chunk)
+            if pending is not None:
+                yield pending
+            pending = ring
+        if pending is not None:
+            yield pending
+
+    def open_pcm_stream(self, text):
+        polly = self.clients.client('polly')
+        response = polly.synthesize_speech(
+            Text=text,
+            OutputFormat='pcm',
+            SampleRate=str(PCM_SAMPLE_RATE),
+            TextType=self.text_type,
+            VoiceId=self.voice_id)
+        ring = RingBuffer()
+        ring.start_filling(response["AudioStream"])
+        return ring
 
     def cleanup(self):
-        if (self.audio_file_path):
-            os.unlink(self.audio_file_path)
-            self.audio_file_path = ""
+        while self.audio_parts is not None:
+            # collect any chunks that were never played
+            try:
+                self.audio_part_paths.append(next(self.audio_parts))
+            except StopIteration:
+                break
+            except Exception:
+                continue
+        if not self.is_cached_audio:
+            for path in [self.audio_file_path] + self.audio_part_paths:
+                if path:
+                    os.unlink(path)
+        self.audio_file_path = ""
+        self.audio_parts = None
+        self.audio_part_paths = []
         self.message = ""
         self.is_audio_ready = False
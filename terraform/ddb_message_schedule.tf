@@ -15,6 +15,25 @@ resource "aws_dynamodb_table" "ddb_message_schedule" {
     type = "S"
   }
 
+  attribute {
+    name = "next_due_bucket"
+    type = "S"
+  }
+
+  attribute {
+    name = "next_occurrence_utc"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "next_due_bucket-index"
+    hash_key        = "next_due_bucket"
+    range_key       = "next_occurrence_utc"
+    read_capacity   = 20
+    write_capacity  = 20
+    projection_type = "ALL"
+  }
+
   ttl {
     attribute_name = "TimeToExist"
     enabled = false
@@ -0,0 +1,32 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import pytest
+from helpers.db_helpers import forget_validated_tables
+from messages.message_manager import clear_queue_cache
+from cache import cache_manager
+
+
+@pytest.fixture(autouse=True)
+def reset_process_caches():
+    """every test gets fresh moto backends, so nothing cached about tables,
+    queues or buckets can carry over"""
+    forget_validated_tables()
+    clear_queue_cache()
+    cache_manager.forget_sync_times()
+
+
+@pytest.fixture(autouse=True)
+def cache_folder(monkeypatch, tmpdir):
+    """keep synced files and manifests out of the real ~/.pollexy"""
+    folder = tmpdir.join('cache')
+    monkeypatch.setattr(cache_manager, 'CACHE_BASE_FOLDER', str(folder))
+    return folder
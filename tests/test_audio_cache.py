@@ -0,0 +1,49 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import os
+import time
+from StringIO import StringIO
+from speaker.audio_cache import AudioCache, audio_cache_key
+
+
+def test_cache_key_covers_every_synthesis_input():
+    key = audio_cache_key('hello', 'text', 'Joanna', 'ogg_vorbis')
+    assert key == audio_cache_key('hello', 'text', 'Joanna', 'ogg_vorbis')
+    assert key != audio_cache_key('hello', 'ssml', 'Joanna', 'ogg_vorbis')
+    assert key != audio_cache_key('hello', 'text', 'Brian', 'ogg_vorbis')
+    assert key != audio_cache_key('hello', 'text', 'Joanna', 'mp3')
+
+
+def test_put_then_get_is_a_hit(tmpdir):
+    cache = AudioCache(CacheFolder=str(tmpdir))
+    assert cache.get('hello', 'text', 'Joanna', 'ogg_vorbis') is None
+    path = cache.put('hello', 'text', 'Joanna', 'ogg_vorbis',
+                     StringIO('audio'))
+    assert path.endswith('.ogg')
+    assert cache.get('hello', 'text', 'Joanna', 'ogg_vorbis') == path
+    assert open(path).read() == 'audio'
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+    assert [f for f in os.listdir(str(tmpdir)) if f.endswith('.tmp')] == []
+
+
+def test_least_recently_used_audio_is_evicted(tmpdir):
+    cache = AudioCache(CacheFolder=str(tmpdir), MaxBytes=10)
+    first = cache.put('one', 'text', 'Joanna', 'ogg_vorbis',
+                      StringIO('12345'))
+    second = cache.put('two', 'text', 'Joanna', 'ogg_vorbis',
+                       StringIO('12345'))
+    past = time.time() - 60
+    os.utime(second, (past, past))
+    cache.get('one', 'text', 'Joanna', 'ogg_vorbis')
+    cache.put('three', 'text', 'Joanna', 'ogg_vorbis', StringIO('12345'))
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
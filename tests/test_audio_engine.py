@@ -0,0 +1,148 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import audioop
+import sys
+import threading
+import pytest
+from mock import MagicMock, patch
+from speaker.audio_engine import AudioEngine
+from speaker.ring_buffer import RingBuffer
+
+
+@pytest.fixture
+def mixer():
+    """a stubbed pygame whose Channel(0) is never busy, so every sound is
+    handed straight to channel.play"""
+    pg = MagicMock()
+    pg.mixer.get_init.return_value = (44100, -16, 2)
+    pg.mixer.Channel.return_value.get_busy.return_value = False
+    pg.mixer.Sound.side_effect = lambda *args, **kw: kw.get('buffer', args)
+    with patch('speaker.audio_engine.pygame', pg):
+        yield pg
+
+
+def played(mixer):
+    channel = mixer.mixer.Channel.return_value
+    return [c[0][0] for c in channel.play.call_args_list]
+
+
+def test_requests_are_played_in_the_order_they_were_queued(mixer, tmpdir):
+    engine = AudioEngine(ChimePath=str(tmpdir))
+    first = engine.play(['a', 'b'])
+    second = engine.play(iter(['c']))
+    third = engine.play_file('d.mp3', Chime='ding')
+    assert third.wait(5)
+    assert first.done.is_set() and second.done.is_set()
+    assert played(mixer) == ['a', 'b', 'c',
+                             ('{}/ding.wav'.format(tmpdir),), ('d.mp3',)]
+    assert engine.stop()
+
+
+def test_mixer_failure_fails_only_that_request(mixer, tmpdir):
+    def play(sound):
+        if sound == 'bad':
+            raise RuntimeError('mixer not initialized')
+    mixer.mixer.Channel.return_value.play.side_effect = play
+    engine = AudioEngine(ChimePath=str(tmpdir))
+    callbacks = []
+    failed = engine.play(['bad', 'never'], Callback=callbacks.append)
+    ok = engine.play(['good'])
+    assert ok.wait(5)
+    assert isinstance(failed.error, RuntimeError)
+    assert callbacks == [failed]
+    assert ok.error is None
+    assert played(mixer) == ['bad', 'good']
+    assert engine.stop()
+
+
+def test_stop_finishes_queued_requests_then_closes_the_mixer(mixer, tmpdir):
+    engine = AudioEngine(ChimePath=str(tmpdir))
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        yield 'a'
+    playback = engine.play(slow())
+    threading.Timer(0.05, release.set).start()
+    assert engine.stop()
+    assert playback.done.is_set()
+    assert not engine.worker.is_alive()
+    assert mixer.mixer.quit.called
+    late = engine.play(['b'])
+    assert late.done.is_set()
+    assert isinstance(late.error, RuntimeError)
+    assert played(mixer) == ['a']
+
+
+def test_requests_racing_stop_are_always_finished(mixer, tmpdir):
+    engine = AudioEngine(ChimePath=str(tmpdir))
+    playbacks = []
+    started = threading.Event()
+
+    def keep_playing():
+        started.set()
+        while not engine.stopped:
+            playbacks.append(engine.play(['a']))
+        playbacks.append(engine.play(['b']))
+    players = [threading.Thread(target=keep_playing) for _ in range(0, 4)]
+    for t in players:
+        t.start()
+    started.wait(5)
+    assert engine.stop()
+    for t in players:
+        t.join()
+    assert all(p.done.is_set() for p in playbacks)
+    assert isinstance(playbacks[-1].error, RuntimeError)
+
+
+def test_pcm_is_played_as_it_is_read_from_the_ring(mixer, tmpdir):
+    engine = AudioEngine(ChimePath=str(tmpdir))
+    pcm = b''.join(chr(i % 256) for i in range(0, 10000))
+    ring = RingBuffer(capacity=1024)
+    writer = threading.Thread(target=lambda: (ring.write(pcm[:4999]),
+                                              ring.write(pcm[4999:]),
+                                              ring.close()))
+    writer.start()
+    assert engine.play_pcm([ring], 44100).wait(5)
+    writer.join()
+    sounds = played(mixer)
+    assert len(sounds) > 1
+    assert all(len(s) % 4 == 0 for s in sounds)
+    assert b''.join(sounds) == audioop.tostereo(pcm, 2, 1, 1)
+    assert ring.closed
+    assert engine.stop()
+
+
+def test_pcm_is_resampled_to_the_mixer_rate(mixer, tmpdir):
+    engine = AudioEngine(ChimePath=str(tmpdir))
+    rings = [RingBuffer(), RingBuffer()]
+    for r in rings:
+        r.write(b'\x00\x01' * 1600)
+        r.close()
+    assert engine.play_pcm(rings, 16000).wait(5)
+    total = sum(len(s) for s in played(mixer))
+    # 0.2s of 16 bit stereo at 44.1kHz, give or take a sample
+    assert abs(total - 0.2 * 44100 * 4) <= 16
+    assert engine.stop()
+
+
+def test_ring_errors_fail_the_playback(mixer, tmpdir):
+    engine = AudioEngine(ChimePath=str(tmpdir))
+    ring = RingBuffer()
+    try:
+        raise IOError('connection reset')
+    except IOError:
+        ring.close(sys.exc_info())
+    playback = engine.play_pcm([ring], 44100)
+    assert playback.wait(5)
+    assert isinstance(playback.error, IOError)
+    assert engine.stop()
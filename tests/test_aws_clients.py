@@ -0,0 +1,38 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import threading
+from mock import MagicMock
+from helpers.aws_clients import ClientPool
+
+
+def test_client_is_created_once_per_service_and_region():
+    session = MagicMock()
+    pool = ClientPool(Session=session, MaxPoolConnections=25)
+    assert pool.client('sqs') is pool.client('sqs')
+    pool.client('sqs', 'eu-west-1')
+    assert session.client.call_count == 2
+    config = session.client.call_args[1]['config']
+    assert config.max_pool_connections == 25
+
+
+def test_resources_are_per_thread():
+    session = MagicMock()
+    session.resource.side_effect = lambda *a, **kw: MagicMock()
+    pool = ClientPool(Session=session)
+    resources = []
+    main = pool.resource('dynamodb')
+    t = threading.Thread(
+        target=lambda: resources.append(pool.resource('dynamodb')))
+    t.start()
+    t.join()
+    assert main is pool.resource('dynamodb')
+    assert resources[0] is not main
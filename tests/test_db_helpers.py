@@ -0,0 +1,118 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import boto3
+import pytest
+import time
+from mock import patch, MagicMock
+from moto import mock_dynamodb2
+from helpers.db_helpers import scan_items
+from locator.locator import LocationManager, LOCATION_TABLE
+
+
+class SegmentTable(object):
+    """fake table that pages through two items per segment"""
+    def __init__(self, fail_segment=None):
+        self.fail_segment = fail_segment
+
+    def scan(self, **kwargs):
+        segment = kwargs['Segment']
+        if segment == self.fail_segment:
+            raise ValueError('segment failed')
+        page = kwargs.get('ExclusiveStartKey', 0)
+        response = {'Items': [{'id': '{}-{}'.format(segment, page)}]}
+        if page == 0:
+            response['LastEvaluatedKey'] = 1
+        return response
+
+
+class EndlessTable(object):
+    """fake table that always has another page"""
+    def __init__(self):
+        self.scans = 0
+
+    def scan(self, **kwargs):
+        self.scans += 1
+        page = kwargs.get('ExclusiveStartKey', 0)
+        return {'Items': [{'id': page}], 'LastEvaluatedKey': page + 1}
+
+
+def fake_clients(table):
+    clients = MagicMock()
+    clients.resource.return_value.Table.return_value = table
+    return clients
+
+
+@mock_dynamodb2
+def test_scan_items_follows_last_evaluated_key():
+    lm = LocationManager()
+    for i in range(5):
+        lm.upsert(Name='room{}'.format(i))
+    names = [i['LocationName'] for i in scan_items(LOCATION_TABLE, Limit=2)]
+    assert sorted(names) == ['room{}'.format(i) for i in range(5)]
+
+
+@mock_dynamodb2
+def test_get_all_returns_every_location():
+    lm = LocationManager()
+    lm.upsert(Name='kitchen')
+    lm.upsert(Name='bedroom')
+    names = [l.location_name for l in lm.get_all()]
+    assert sorted(names) == ['bedroom', 'kitchen']
+
+
+def test_parallel_scan_reads_every_segment():
+    ids = [i['id'] for i in scan_items('test', TotalSegments=3,
+                                       Clients=fake_clients(SegmentTable()))]
+    assert sorted(ids) == ['0-0', '0-1', '1-0', '1-1', '2-0', '2-1']
+
+
+def test_parallel_scan_raises_segment_errors():
+    table = SegmentTable(fail_segment=1)
+    with pytest.raises(ValueError):
+        list(scan_items('test', TotalSegments=3,
+                        Clients=fake_clients(table)))
+
+
+def test_parallel_scan_stops_paging_when_consumer_stops():
+    table = EndlessTable()
+    items = scan_items('test', TotalSegments=2, Clients=fake_clients(table))
+    next(items)
+    items.close()
+    time.sleep(1)
+    scans = table.scans
+    time.sleep(1)
+    assert table.scans == scans
+
+
+def test_parallel_scan_uses_the_given_clients():
+    clients = fake_clients(SegmentTable())
+    with patch.object(boto3.session, 'Session') as session:
+        list(scan_items('test', TotalSegments=2, Clients=clients))
+    assert not session.called
+    assert clients.resource.call_count == 2
+
+
+@mock_dynamodb2
+def test_tables_are_only_validated_once():
+    LocationManager()
+    with patch('helpers.db_helpers.does_table_exist') as exists:
+        LocationManager()
+        LocationManager()
+    assert not exists.called
+
+
+@mock_dynamodb2
+def test_trust_schema_skips_table_check():
+    with patch.dict('os.environ', {'POLLEXY_TRUST_SCHEMA': 'true'}):
+        with patch('helpers.db_helpers.does_table_exist') as exists:
+            LocationManager()
+    assert not exists.called
@@ -0,0 +1,174 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import pytest
+import time
+from mock import MagicMock, patch
+from speaker.location_player import LocationPlayer, \
+    VISIBILITY_TIMEOUT_SECONDS
+from speaker.location_agent import LocationAgent
+from messages.polling import IdleBackoff
+
+
+def message_managers(*speeches):
+    managers = []
+    for speech in speeches:
+        mm = MagicMock()
+        mm.write_speech.return_value = ('Joanna', speech)
+        managers.append(mm)
+    return managers
+
+
+@patch('speaker.location_player.Speaker')
+@patch('speaker.location_player.MessageManager')
+def test_jobs_are_synthesized_ahead_and_acknowledged(mock_mm, mock_speaker):
+    managers = message_managers('<speak>one</speak>', '<speak>two</speak>')
+    mock_mm.side_effect = managers + message_managers(*[None] * 1000)
+    player = LocationPlayer(PersonName='calvin', LocationName='kitchen')
+    player.start()
+    try:
+        first = player.next_job(Timeout=5)
+        second = player.next_job(Timeout=5)
+        assert first.speech == '<speak>one</speak>'
+        assert second.speech == '<speak>two</speak>'
+        assert first.speaker.generate_audio.called
+        player.succeed(first)
+        player.fail(second, 'NoResponse')
+    finally:
+        player.stop()
+    managers[0].succeed_messages.assert_called_once_with(DontDelete=False)
+    managers[1].fail_messages.assert_called_once_with(Reason='NoResponse',
+                                                      DontDelete=False)
+
+
+@patch('speaker.location_player.Speaker')
+@patch('speaker.location_player.MessageManager')
+def test_unplayed_jobs_go_back_on_the_queue(mock_mm, mock_speaker):
+    managers = message_managers('<speak>one</speak>', '<speak>two</speak>',
+                                '<speak>three</speak>')
+    mock_mm.side_effect = managers
+    player = LocationPlayer(PersonName='calvin', LocationName='kitchen')
+    player.start()
+    player.next_job(Timeout=5)
+    deadline = time.time() + 5
+    while mock_mm.call_count < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    player.stop()
+    for mm in managers[1:]:
+        mm.delete_sqs_msgs.assert_called_once_with(VisibilityTimeout=0)
+
+
+@patch('speaker.location_player.Speaker')
+@patch('speaker.location_player.MessageManager')
+def test_waiting_and_playing_jobs_stay_hidden(mock_mm, mock_speaker):
+    managers = message_managers('<speak>one</speak>', '<speak>two</speak>')
+    mock_mm.side_effect = managers + message_managers(*[None] * 1000)
+    player = LocationPlayer(PersonName='calvin', LocationName='kitchen',
+                            VisibilityTimeout=7, RenewSeconds=0.02)
+    player.start()
+    try:
+        playing = player.next_job(Timeout=5)
+        deadline = time.time() + 5
+        while (managers[1].hold_sqs_msgs.call_count < 2 or
+               managers[0].hold_sqs_msgs.call_count < 2) and \
+                time.time() < deadline:
+            time.sleep(0.01)
+        player.succeed(playing)
+        waiting = player.next_job(Timeout=5)
+        player.succeed(waiting)
+    finally:
+        player.stop()
+    for mm in managers:
+        assert mm.write_speech.call_args[1]['VisibilityTimeout'] == 7
+        assert mm.hold_sqs_msgs.call_count >= 2
+        mm.hold_sqs_msgs.assert_called_with(VisibilityTimeout=7)
+        mm.succeed_messages.assert_called_once_with(DontDelete=False)
+    assert player.held == []
+
+
+@patch('speaker.location_player.MessageManager')
+def test_fetch_errors_are_raised_to_the_player(mock_mm):
+    mock_mm.side_effect = RuntimeError('no queue')
+    player = LocationPlayer(PersonName='calvin', LocationName='kitchen')
+    player.start()
+    try:
+        with pytest.raises(RuntimeError):
+            for _ in range(0, 10):
+                player.next_job(Timeout=0.1)
+    finally:
+        player.stop()
+
+
+@patch('speaker.location_player.MessageManager')
+def test_empty_receives_rest_and_are_counted(mock_mm):
+    mock_mm.side_effect = lambda **kwargs: message_managers(None)[0]
+    backoff = IdleBackoff(Initial=0.01, Maximum=0.01)
+    player = LocationPlayer(PersonName='calvin', LocationName='kitchen',
+                            Backoff=backoff)
+    player.start()
+    deadline = time.time() + 5
+    while player.stats.as_dict()['receives'] < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    player.stop()
+    stats = player.stats.as_dict()
+    assert stats['receives'] >= 3
+    assert stats['empty_receives'] == stats['receives']
+    assert stats['idle_seconds'] >= 0
+
+
+def bot_managers(*bots):
+    managers = []
+    for b in bots:
+        mm = MagicMock()
+        mm.get_messages.return_value = b
+        managers.append(mm)
+    return managers
+
+
+@patch('speaker.location_agent.LocationPlayer')
+@patch('speaker.location_agent.MessageManager')
+def test_agent_hands_out_bot_jobs(mock_mm, mock_player):
+    managers = bot_managers(['bot'])
+    mock_mm.side_effect = managers + bot_managers(*[[]] * 1000)
+    agent = LocationAgent(PersonName='calvin', LocationName='kitchen',
+                          WaitTimeSeconds=20, MaxIdleSeconds=0.01)
+    agent.start()
+    try:
+        deadline = time.time() + 5
+        job = agent.next_bot_job()
+        while not job and time.time() < deadline:
+            time.sleep(0.01)
+            job = agent.next_bot_job()
+        assert job.bots == ['bot']
+        agent.succeed_bot_job(job)
+    finally:
+        agent.stop()
+    managers[0].get_messages.assert_called_once_with(
+        MessageType='Bot', PersonName='calvin', WaitTimeSeconds=20,
+        VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS)
+    mock_player.return_value.hold.assert_called_once_with(job)
+    mock_player.return_value.release.assert_called_once_with(job)
+    managers[0].succeed_messages.assert_called_once_with(DontDelete=False)
+    assert agent.stats()['Bot']['messages'] == 1
+
+
+@patch('speaker.location_agent.LocationPlayer')
+@patch('speaker.location_agent.MessageManager')
+def test_agent_wakes_on_new_motion(mock_mm, mock_player):
+    agent = LocationAgent(PersonName='calvin', LocationName='kitchen')
+    loc = MagicMock(last_activity='t1', is_motion=True)
+    with patch.object(agent, 'wake') as mock_wake:
+        assert agent.check_motion(loc)
+        assert not agent.check_motion(loc)
+        loc.last_activity = 't2'
+        loc.is_motion = False
+        assert not agent.check_motion(loc)
+    assert mock_wake.call_count == 1
@@ -26,7 +26,7 @@ patcher.start()
 
 from locator.locator import LocationAvailability, TimeWindow
 from locator.locator import LocationStatus, LocationManager, \
-    LocationVerification
+    LocationVerification, LocationStateCache, LOCATION_STATE_TTL_SECONDS
 
 ical_event_night = """
 BEGIN:VEVENT
@@ -477,3 +477,107 @@ def test_verify_switch_with_no_press_returns_false():
 
     done, count, timeout = lv.verify_person_at_location()
     assert not done and count == 2 and timeout >= 2 and timeout < 3
+
+
+def location_state_cache(last_activity, **kwargs):
+    lm = MagicMock()
+    loc = LocationAvailability(LocationName='kitchen')
+    loc.last_activity = last_activity
+    lm.get_location.return_value = loc
+    lm.get_last_activity.return_value = last_activity.isoformat()
+    return lm, LocationStateCache(LocationName='kitchen', LocationManager=lm,
+                                  **kwargs)
+
+
+@patch('locator.locator.time.time')
+def test_location_state_cache_does_not_reload_within_ttl(mock_time):
+    mock_time.return_value = 1000
+    lm, cache = location_state_cache(arrow.utcnow(), TtlSeconds=10)
+    cache.get()
+    mock_time.return_value = 1005
+    cache.get()
+    assert lm.get_location.call_count == 1
+    assert lm.get_last_activity.call_count == 0
+
+
+@patch('locator.locator.time.time')
+def test_location_state_cache_keeps_location_if_activity_unchanged(mock_time):
+    mock_time.return_value = 1000
+    lm, cache = location_state_cache(arrow.utcnow(), TtlSeconds=10)
+    cache.get()
+    mock_time.return_value = 1011
+    cache.get()
+    assert lm.get_last_activity.call_count == 1
+    assert lm.get_location.call_count == 1
+
+
+@patch('locator.locator.time.time')
+def test_location_state_cache_reloads_when_activity_changes(mock_time):
+    mock_time.return_value = 1000
+    lm, cache = location_state_cache(arrow.utcnow().replace(minutes=-5),
+                                     TtlSeconds=10)
+    assert not cache.get().is_motion
+    lm.get_last_activity.return_value = arrow.utcnow().isoformat()
+    mock_time.return_value = 1011
+    cache.get()
+    assert lm.get_location.call_count == 2
+
+
+@patch('locator.locator.time.time')
+def test_location_state_cache_reloads_past_max_age(mock_time):
+    mock_time.return_value = 1000
+    lm, cache = location_state_cache(arrow.utcnow(), TtlSeconds=10,
+                                     MaxAgeSeconds=60)
+    cache.get()
+    mock_time.return_value = 1061
+    cache.get()
+    assert lm.get_location.call_count == 2
+
+
+@patch('locator.locator.is_recent_motion')
+@patch('locator.locator.time.time')
+def test_location_state_cache_rereads_activity_when_motion_runs_out(
+        mock_time, mock_motion):
+    seen = arrow.utcnow().replace(seconds=-30)
+    cutoff = [seen]
+    mock_motion.side_effect = lambda last_activity: last_activity >= cutoff[0]
+    mock_time.return_value = 1000
+    lm, cache = location_state_cache(seen, TtlSeconds=10)
+    assert cache.get().is_motion
+    cutoff[0] = seen.replace(seconds=1)
+    now = arrow.utcnow()
+    lm.get_last_activity.return_value = now.isoformat()
+    lm.get_location.return_value.last_activity = now
+    mock_time.return_value = 1005
+    assert cache.get().is_motion
+    assert lm.get_last_activity.call_count == 1
+    assert lm.get_location.call_count == 2
+
+
+@patch('locator.locator.time.time')
+def test_location_state_cache_idle_room_reads_once_per_ttl(mock_time):
+    lm, cache = location_state_cache(arrow.utcnow().replace(minutes=-5))
+    # a minute of the speak loop, which checks every half second
+    for tick in range(0, 120):
+        mock_time.return_value = 1000 + tick * 0.5
+        assert not cache.get().is_motion
+    reads = 60 / LOCATION_STATE_TTL_SECONDS
+    assert reads - 1 <= lm.get_last_activity.call_count <= reads
+    assert lm.get_location.call_count == 1
+
+
+@patch('locator.locator.is_recent_motion')
+def test_location_state_cache_recomputes_motion(mock_motion):
+    mock_motion.return_value = True
+    lm, cache = location_state_cache(arrow.utcnow())
+    assert cache.get().is_motion
+    mock_motion.return_value = False
+    assert not cache.get().is_motion
+    assert lm.get_location.call_count == 1
+
+
+@mock_dynamodb2
+def test_get_last_activity_returns_none_without_motion():
+    lm = LocationManager()
+    lm.get_location('kitchen')
+    assert lm.get_last_activity('kitchen') is None
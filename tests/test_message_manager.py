@@ -0,0 +1,213 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+from mock import MagicMock, patch
+from moto import mock_sqs, mock_dynamodb2
+from messages import message_manager
+from messages.message_manager import MessageManager, publish_to_locations, \
+    send_batch, get_queue
+
+
+def queued_count(queue):
+    queue.reload()
+    return int(queue.attributes['ApproximateNumberOfMessages'])
+
+
+def reminder(i, **kwargs):
+    m = {'Body': 'Reminder {}'.format(i),
+         'UUID': 'uuid-{}'.format(i),
+         'PersonName': 'calvin',
+         'Windows': '[]'}
+    m.update(kwargs)
+    return m
+
+
+@mock_sqs
+def test_publish_messages_sends_batches_of_ten():
+    mm = MessageManager(LocationName='kitchen')
+    with patch.object(mm.queue, 'send_messages',
+                      wraps=mm.queue.send_messages) as send:
+        results = mm.publish_messages([reminder(i) for i in range(25)])
+    assert all(r['Successful'] for r in results)
+    assert send.call_count == 3
+    assert queued_count(mm.queue) == 25
+
+
+@mock_sqs
+def test_publish_messages_routes_bots_to_bot_queue():
+    mm = MessageManager(LocationName='kitchen')
+    mm.publish_messages([reminder(0),
+                         reminder(1, BotNames='PollexyHygieneBot')])
+    assert queued_count(mm.queue) == 1
+    assert queued_count(mm.bot_queue) == 1
+
+
+def test_send_batch_retries_failed_entries():
+    queue = MagicMock()
+    queue.send_messages.side_effect = [
+        {'Successful': [{'Id': '0', 'MessageId': 'a'}],
+         'Failed': [{'Id': '1', 'Code': 'InternalError',
+                     'SenderFault': False},
+                    {'Id': '2', 'Code': 'InvalidParameterValue',
+                     'SenderFault': True}]},
+        {'Successful': [{'Id': '1', 'MessageId': 'b'}]}]
+    with patch.object(message_manager.time, 'sleep'):
+        results = send_batch(queue, [{'Id': str(i)} for i in range(3)])
+    retried = queue.send_messages.call_args_list[1][1]['Entries']
+    assert [e['Id'] for e in retried] == ['1']
+    assert results['1']['MessageId'] == 'b'
+    assert not results['2']['Successful']
+
+
+@mock_sqs
+def test_publish_to_locations_keeps_message_order():
+    messages = [reminder(0, LocationName='kitchen'),
+                reminder(1, LocationName='bedroom'),
+                reminder(2, LocationName='kitchen')]
+    results = publish_to_locations(messages)
+    assert len(results) == 3
+    assert all(r['Successful'] for r in results)
+    assert queued_count(MessageManager(LocationName='kitchen').queue) == 2
+    assert queued_count(MessageManager(LocationName='bedroom').queue) == 1
+
+
+def test_send_batch_keeps_results_of_sent_chunks_when_one_raises():
+    queue = MagicMock()
+    queue.send_messages.side_effect = [
+        {'Successful': [{'Id': str(i), 'MessageId': str(i)}
+                        for i in range(10)]},
+        RuntimeError('throttled'),
+        {'Successful': [{'Id': '20', 'MessageId': '20'}]}]
+    results = send_batch(queue, [{'Id': str(i)} for i in range(21)])
+    assert all(results[str(i)]['Successful'] for i in range(10))
+    assert not any(results[str(i)]['Successful'] for i in range(10, 20))
+    assert results['10']['Error'] == 'RuntimeError'
+    assert results['20']['Successful']
+
+
+@mock_sqs
+def test_publish_to_locations_fails_only_the_broken_location():
+    messages = [reminder(0, LocationName='kitchen'),
+                reminder(1, LocationName='bedroom'),
+                reminder(2, LocationName='kitchen')]
+    real_manager = message_manager.MessageManager
+
+    def manager(**kwargs):
+        if kwargs['LocationName'] == 'bedroom':
+            raise RuntimeError('no queue')
+        return real_manager(**kwargs)
+    with patch.object(message_manager, 'MessageManager', manager):
+        results = publish_to_locations(messages)
+    assert [r['Successful'] for r in results] == [True, False, True]
+    assert queued_count(MessageManager(LocationName='kitchen').queue) == 2
+
+
+@mock_sqs
+def test_publish_messages_fails_only_messages_that_cant_be_built():
+    mm = MessageManager(LocationName='kitchen')
+    messages = [reminder(0), reminder(1), reminder(2)]
+    del messages[1]['Windows']
+    with patch.object(message_manager, 'PersonManager') as pm:
+        pm.return_value.get_person.return_value = None
+        results = mm.publish_messages(messages)
+    assert [r['Successful'] for r in results] == [True, False, True]
+    assert queued_count(mm.queue) == 2
+
+
+@mock_sqs
+def test_delete_sqs_msgs_deletes_in_batches():
+    mm = MessageManager(LocationName='kitchen')
+    mm.publish_messages([reminder(i) for i in range(15)])
+    mm.sqs_msgs = mm.queue.receive_messages(MaxNumberOfMessages=10) + \
+        mm.queue.receive_messages(MaxNumberOfMessages=10)
+    mm.delete_sqs_msgs()
+    assert mm.sqs_msgs == []
+    assert queued_count(mm.queue) == 0
+
+
+@mock_sqs
+def test_delete_sqs_msgs_with_visibility_timeout_keeps_messages():
+    mm = MessageManager(LocationName='kitchen')
+    mm.publish_messages([reminder(i) for i in range(3)])
+    mm.sqs_msgs = mm.queue.receive_messages(MaxNumberOfMessages=10,
+                                            VisibilityTimeout=300)
+    mm.delete_sqs_msgs(VisibilityTimeout=0)
+    again = mm.queue.receive_messages(MaxNumberOfMessages=10)
+    assert len(again) == 3
+
+
+@mock_sqs
+@mock_dynamodb2
+def test_get_messages_drains_queue():
+    mm = MessageManager(LocationName='kitchen')
+    mm.publish_messages([reminder(i) for i in range(25)])
+    msgs = mm.get_messages(PersonName='calvin')
+    assert len(msgs) == 25
+    assert len(mm.messages['calvin']) == 25
+    assert len(mm.sqs_msgs) == 25
+
+
+@mock_sqs
+@mock_dynamodb2
+def test_get_messages_releases_other_peoples_messages():
+    mm = MessageManager(LocationName='kitchen')
+    mm.publish_messages([reminder(0), reminder(1),
+                         reminder(2, PersonName='chloe')])
+    msgs = mm.get_messages(PersonName='chloe')
+    assert [m.person_name for m in msgs] == ['chloe']
+    assert mm.messages.keys() == ['chloe']
+    again = mm.get_messages(PersonName='calvin')
+    assert len(again) == 2
+
+
+@mock_sqs
+@mock_dynamodb2
+def test_get_messages_stops_at_budget():
+    mm = MessageManager(LocationName='kitchen')
+    mm.publish_messages([reminder(i) for i in range(25)])
+    msgs = mm.get_messages(MaxTotalMessages=12)
+    assert len(msgs) == 12
+
+
+@mock_sqs
+@mock_dynamodb2
+def test_get_messages_and_hold_set_visibility():
+    mm = MessageManager(LocationName='kitchen')
+    mm.publish_messages([reminder(i) for i in range(3)])
+    assert len(mm.get_messages(VisibilityTimeout=300)) == 3
+    assert mm.queue.receive_messages(MaxNumberOfMessages=10) == []
+    mm.hold_sqs_msgs(VisibilityTimeout=0)
+    assert len(mm.sqs_msgs) == 3
+    assert len(mm.queue.receive_messages(MaxNumberOfMessages=10)) == 3
+
+
+@mock_sqs
+def test_get_queue_caches_queue_urls():
+    url = MessageManager(LocationName='kitchen').queue.url
+    assert url.endswith('/pollexy-inbox-kitchen')
+    clients = MagicMock()
+    clients.region = None
+    with patch.object(message_manager, 'get_client_pool') as pool:
+        get_queue('pollexy-inbox-kitchen', clients)
+    assert not pool.called
+    assert not clients.client.called
+    clients.resource.return_value.Queue.assert_called_once_with(url)
+
+
+@mock_sqs
+@patch('messages.message_manager.Scheduler')
+def test_message_manager_passes_its_clients_on(mock_scheduler):
+    clients = MagicMock()
+    mm = MessageManager(LocationName='kitchen', Clients=clients)
+    mm.sqs_msgs = []
+    mm.succeed_messages()
+    mock_scheduler.assert_called_once_with(Clients=clients)
+    assert clients.client.return_value.get_queue_url.called
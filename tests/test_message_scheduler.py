@@ -9,11 +9,14 @@
 # or implied. See the License for the specific language governing permissions
 # and limitations under the License.
 
+import boto3
+from mock import patch
 from moto import mock_dynamodb2
 import datetime
 import pytest
 import arrow
 from scheduler.scheduler import Scheduler, MESSAGE_SCHEDULE_DB
+from messages import message
 from messages.message import ScheduledMessage
 from helpers.db_helpers import does_table_exist
 
@@ -462,3 +465,138 @@ def test_passing_interval_adds_to_ical():
             Interval=5,
             PersonName="test")
     assert ical == m.to_ical()
+
+
+def daily_message(start_date):
+    return ScheduledMessage(
+        StartDateTimeInUtc=start_date,
+        Frequency='DAILY',
+        Body="Test Message Body",
+        PersonName="Testperson",
+        BotNames="PollexyHygieneBot",
+        RequiredBots="PollexyHygieneBot",
+        IceBreaker="Hello",
+        EndDateTimeInUtc=start_date.replace(years=5))
+
+
+def get_db_item(msg):
+    dynamodb = boto3.resource('dynamodb')
+    table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+    return table.get_item(Key={'uuid': msg.uuid_key,
+                               'person_name': msg.person_name})['Item']
+
+
+@mock_dynamodb2
+def test_scheduled_message_is_read_from_due_index():
+    msg = daily_message(arrow.utcnow().replace(hours=-1))
+    scheduler_under_test = Scheduler()
+    scheduler_under_test.schedule_message(msg)
+    m = scheduler_under_test.get_messages(UseDueIndex=True)
+    assert len(m) == 1
+    assert m[0].uuid_key == msg.uuid_key
+
+
+@mock_dynamodb2
+def test_future_message_is_not_read_from_due_index():
+    msg = daily_message(arrow.utcnow().replace(days=2))
+    scheduler_under_test = Scheduler()
+    scheduler_under_test.schedule_message(msg)
+    assert len(scheduler_under_test.get_messages(UseDueIndex=True)) == 0
+    assert len(scheduler_under_test.get_messages(ready_only=False)) == 1
+
+
+@mock_dynamodb2
+def test_update_last_occurrence_moves_next_occurrence():
+    start_date = arrow.get('2012-01-01 01:01:00 UTC')
+    msg = daily_message(start_date)
+    scheduler_under_test = Scheduler()
+    scheduler_under_test.schedule_message(msg)
+    assert get_db_item(msg)['next_occurrence_utc'] == start_date.isoformat()
+    scheduler_under_test.update_last_occurrence(
+        msg.uuid_key, msg.person_name, start_date.replace(minutes=5))
+    assert get_db_item(msg)['next_occurrence_utc'] == \
+        start_date.replace(days=1).isoformat()
+
+
+@mock_dynamodb2
+def test_set_expired_removes_message_from_due_index():
+    msg = daily_message(arrow.utcnow().replace(hours=-1))
+    scheduler_under_test = Scheduler()
+    scheduler_under_test.schedule_message(msg)
+    scheduler_under_test.set_expired(msg.uuid_key, msg.person_name)
+    assert 'next_due_bucket' not in get_db_item(msg)
+    assert len(scheduler_under_test.get_messages(UseDueIndex=True)) == 0
+
+
+@mock_dynamodb2
+def test_ended_recurrence_is_removed_from_due_index():
+    start_date = arrow.utcnow().replace(days=-10)
+    msg = ScheduledMessage(
+        StartDateTimeInUtc=start_date,
+        Frequency='DAILY',
+        Body="Test Message Body",
+        PersonName="Testperson",
+        BotNames="PollexyHygieneBot",
+        RequiredBots="PollexyHygieneBot",
+        IceBreaker="Hello",
+        EndDateTimeInUtc=start_date.replace(days=2))
+    scheduler_under_test = Scheduler()
+    scheduler_under_test.schedule_message(msg)
+    # the last occurrence was recorded without the message being expired
+    # or the index moved on
+    dynamodb = boto3.resource('dynamodb')
+    table = dynamodb.Table(MESSAGE_SCHEDULE_DB)
+    table.update_item(
+        Key={'uuid': msg.uuid_key, 'person_name': msg.person_name},
+        UpdateExpression='SET last_occurrence_in_utc=:lo',
+        ExpressionAttributeValues={
+            ':lo': start_date.replace(days=1, minutes=5).isoformat()})
+    assert get_db_item(msg)['next_occurrence_utc'] == start_date.isoformat()
+    assert len(scheduler_under_test.get_messages(UseDueIndex=True)) == 0
+    item = get_db_item(msg)
+    assert 'next_due_bucket' not in item
+    assert 'next_occurrence_utc' not in item
+
+
+def test_recurrence_rule_is_parsed_once_per_ical_and_start():
+    message._rule_cache.clear()
+    ical = daily_message(arrow.get('2012-01-01 01:01:00 UTC')).to_ical()
+    with patch.object(message, 'Calendar', wraps=message.Calendar) as cal:
+        for _ in range(3):
+            m = ScheduledMessage(
+                StartDateTimeInUtc=arrow.get('2012-01-01 01:01:00 UTC'),
+                LastOccurrenceInUtc=arrow.get('2012-01-01 01:05:00 UTC'),
+                CompareDateTimeInUtc=arrow.get('2012-01-01 03:00:00 UTC'),
+                ical=ical,
+                Body="Test Message Body",
+                PersonName="Testperson",
+                EndDateTimeInUtc=arrow.get('2013-01-01 01:01:00 UTC'))
+            str(m)
+    assert cal.from_ical.call_count == 2
+    assert m.next_occurrence_utc == arrow.get('2012-01-02 01:01:00 UTC')
+
+
+def test_marking_spoken_recomputes_next_occurrence():
+    ical = daily_message(arrow.get('2012-01-01 01:01:00 UTC')).to_ical()
+    m = ScheduledMessage(
+        StartDateTimeInUtc=arrow.get('2012-01-01 01:01:00 UTC'),
+        LastOccurrenceInUtc=arrow.get('2012-01-01 01:05:00 UTC'),
+        CompareDateTimeInUtc=arrow.get('2012-01-03 03:00:00 UTC'),
+        ical=ical,
+        Body="Test Message Body",
+        PersonName="Testperson",
+        EndDateTimeInUtc=arrow.get('2013-01-01 01:01:00 UTC'))
+    assert m.next_occurrence_utc == arrow.get('2012-01-03 01:01:00 UTC')
+    m.mark_spoken(arrow.get('2012-01-03 01:05:00 UTC'))
+    assert m.next_occurrence_utc == arrow.get('2012-01-04 01:01:00 UTC')
+
+
+def test_constructing_message_defers_recurrence_evaluation():
+    with patch.object(ScheduledMessage, 'next_occurrence') as next_occurrence:
+        m = ScheduledMessage(
+            StartDateTimeInUtc=arrow.get('2012-01-01 01:01:00 UTC'),
+            Body="Test Message Body",
+            PersonName="Testperson",
+            EndDateTimeInUtc=arrow.get('2013-01-01 01:01:00 UTC'))
+        assert not next_occurrence.called
+    assert not m.no_more_occurrences
@@ -10,8 +10,14 @@
 # and limitations under the License.
 
 import arrow
+import boto3
+import pytest
 from moto import mock_dynamodb2
-from person.person import Person, PersonTimeWindow, PersonManager
+from mock import patch, MagicMock
+from person.person import Person, PersonTimeWindow, PersonManager, \
+    PersonRepository, PERSON_TABLE, PERSON_HASH_KEY, BATCH_GET_RETRIES, \
+    BATCH_GET_RETRY_DELAY_SECONDS
+from person.availability import AvailabilityMatrix
 
 ical_event_night = """
 BEGIN:VEVENT
@@ -177,3 +183,141 @@ def test_can_save_physical_confirmation_false_preference():
     pm.update_window_set(p)
     p = pm.get_person('calvin')
     assert not p.require_physical_confirmation
+
+
+def create_person_table():
+    boto3.resource('dynamodb').create_table(
+        TableName=PERSON_TABLE,
+        KeySchema=[{'AttributeName': PERSON_HASH_KEY, 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': PERSON_HASH_KEY,
+                               'AttributeType': 'S'}],
+        ProvisionedThroughput={'ReadCapacityUnits': 1,
+                               'WriteCapacityUnits': 1})
+
+
+@mock_dynamodb2
+def test_get_people_loads_everyone_in_batches():
+    create_person_table()
+    pm = PersonManager()
+    for n in range(0, 105):
+        pm.update_window_set(Person(Name='person{}'.format(n)))
+    names = ['person{}'.format(n) for n in range(0, 105)] + ['nobody']
+    people = pm.get_people(names)
+    assert len(people) == 105
+    assert people['person104'].name == 'person104'
+    assert 'nobody' not in people
+
+
+@patch('person.person.time.sleep')
+def test_get_people_backs_off_on_unprocessed_keys(mock_sleep):
+    clients = MagicMock()
+    unprocessed = {PERSON_TABLE: {'Keys': [{'PersonName': 'calvin'}]}}
+    clients.resource.return_value.batch_get_item.return_value = {
+        'Responses': {}, 'UnprocessedKeys': unprocessed}
+    people = PersonManager(Clients=clients).get_people(['calvin'])
+    assert people == {}
+    batch_get = clients.resource.return_value.batch_get_item
+    assert batch_get.call_count == BATCH_GET_RETRIES + 1
+    delays = [c[0][0] for c in mock_sleep.call_args_list]
+    assert len(delays) == BATCH_GET_RETRIES
+    for attempt, delay in enumerate(delays, 1):
+        assert 0 <= delay <= BATCH_GET_RETRY_DELAY_SECONDS * 2 ** attempt
+
+
+@mock_dynamodb2
+def test_repository_only_loads_a_person_once():
+    create_person_table()
+    pm = PersonManager()
+    pm.update_window_set(Person(Name='calvin'))
+    repo = PersonRepository(PersonManager=pm)
+    repo.load(['calvin', 'calvin', 'hobbes'])
+    with patch.object(pm, 'get_people') as get_people:
+        assert repo.get_person('calvin').name == 'calvin'
+        assert repo.get_person('calvin') is repo.get_person('calvin')
+        assert repo.get_person('hobbes') is None
+    assert not get_people.called
+
+
+def test_availability_is_computed_once_per_time():
+    p = Person(Name='calvin')
+    now_dt = arrow.get('2014-01-01T07:10:00.000-05:00')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', Priority=100,
+                                  ical=ical_event_before_school))
+    with patch.object(p.time_windows, 'all_available',
+                      wraps=p.time_windows.all_available) as all_available:
+        assert p.all_available_count(now_dt) == 1
+        assert p.all_available(now_dt)[0].location_name == 'kitchen'
+        p.availability(now_dt)
+    assert all_available.call_count == 1
+
+
+def test_adding_a_window_refreshes_availability():
+    p = Person(Name='calvin')
+    now_dt = arrow.get('2014-01-01T07:10:00.000-05:00')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', Priority=100,
+                                  ical=ical_event_before_school))
+    assert p.all_available_count(now_dt) == 1
+    p.add_window(PersonTimeWindow(LocationName='bedroom', Priority=200,
+                                  ical=ical_event_before_school))
+    assert p.all_available_count(now_dt) == 2
+    p.remove_window_location('bedroom')
+    assert p.all_available_count(now_dt) == 1
+
+
+def test_availability_picks_locations_round_robin():
+    p = Person(Name='calvin')
+    now_dt = arrow.get('2014-01-01T07:10:00.000-05:00')
+    p.add_window(PersonTimeWindow(LocationName='kitchen', Priority=100,
+                                  ical=ical_event_before_school))
+    p.add_window(PersonTimeWindow(LocationName='bedroom', Priority=200,
+                                  ical=ical_event_before_school))
+    avail = p.availability(now_dt)
+    assert avail.pick(-1) == (0, avail.windows[0])
+    assert avail.pick(0)[1].location_name == 'kitchen'
+    assert avail.pick(1)[1].location_name == 'bedroom'
+    p.remove_window_location('bedroom')
+    assert p.availability(now_dt).pick(0)[0] == 0
+
+
+def matrix_people():
+    calvin = Person(Name='calvin')
+    calvin.add_window(PersonTimeWindow(LocationName='kitchen', Priority=100,
+                                       ical=ical_event_before_school))
+    calvin.add_window(PersonTimeWindow(LocationName='bedroom', Priority=200,
+                                       ical=ical_event_before_school))
+    calvin.add_window(PersonTimeWindow(LocationName='office', Priority=300,
+                                       ical=ical_event_before_school,
+                                       IsMuted=True))
+    hobbes = Person(Name='hobbes')
+    hobbes.add_window(PersonTimeWindow(LocationName='kitchen', Priority=100,
+                                       ical=ical_event))
+    return [calvin, hobbes]
+
+
+def test_matrix_matches_person_availability():
+    people = matrix_people()
+    start = arrow.get('2014-01-01T06:30:00.000-05:00')
+    matrix = AvailabilityMatrix(People=people, Start=start, Slots=180)
+    for minutes in range(0, 180, 7):
+        dt = start.replace(minutes=minutes)
+        for p in people:
+            expected = [w.location_name for w in p.all_available(dt)]
+            assert matrix.locations(p.name, dt) == expected
+
+
+def test_matrix_answers_for_everyone_at_once():
+    start = arrow.get('2014-01-01T06:30:00.000-05:00')
+    matrix = AvailabilityMatrix(People=matrix_people(), Start=start,
+                                Slots=120)
+    assert matrix.reachable_at(start) == {}
+    assert matrix.reachable_at(start.replace(minutes=35)) == \
+        {'calvin': ['bedroom', 'kitchen']}
+    assert matrix.reachable_within(60, start) == \
+        {'calvin': ['bedroom', 'kitchen'], 'hobbes': ['kitchen']}
+
+
+def test_matrix_rejects_times_off_the_grid():
+    start = arrow.get('2014-01-01T06:30:00.000-05:00')
+    matrix = AvailabilityMatrix(People=matrix_people(), Start=start)
+    with pytest.raises(ValueError):
+        matrix.reachable_at(start.replace(hours=2))
@@ -236,5 +236,72 @@ def test_can_pull_down_cache_folder():
     assert len(m.mock_calls) == 3
 
 
+def put_chimes(s3, *bodies):
+    for i, body in enumerate(bodies):
+        s3.Bucket('test-bucket').put_object(Key='chimes/file{}'.format(i),
+                                            Body=body)
+
+
+@mock_s3
+def test_sync_only_downloads_new_or_changed_files(cache_folder):
+    s3 = boto3.resource('s3')
+    s3.create_bucket(Bucket="test-bucket")
+    put_chimes(s3, 'one', 'two')
+    cache_manager = CacheManager(BucketName="test-bucket", CacheName="chimes")
+    cache_manager.sync_remote_folder()
+    chimes = cache_folder.join('chimes')
+    assert chimes.join('file1').read() == 'two'
+    put_chimes(s3, 'one', 'changed', 'three')
+    with patch.object(boto3.s3.transfer.S3Transfer, "download_file") as m:
+        m.side_effect = lambda **kwargs: \
+            open(kwargs['filename'], 'w').write(kwargs['key'])
+        cache_manager.sync_remote_folder(Force=True)
+    assert sorted(c[2]['key'] for c in m.mock_calls) == \
+        ['chimes/file1', 'chimes/file2']
+    assert chimes.join('file0').read() == 'one'
+
+
+@mock_s3
+def test_sync_is_skipped_within_the_ttl():
+    s3 = boto3.resource('s3')
+    s3.create_bucket(Bucket="test-bucket")
+    put_chimes(s3, 'one')
+    cache_manager = CacheManager(BucketName="test-bucket", CacheName="chimes")
+    cache_manager.sync_remote_folder()
+    with patch.object(cache_manager, 'get_remote_file_list') as m:
+        CacheManager(BucketName="test-bucket",
+                     CacheName="chimes").sync_remote_folder()
+        cache_manager.sync_remote_folder()
+    assert not m.called
+
+
+@mock_s3
+def test_failed_sync_keeps_finished_downloads_and_is_retried(cache_folder):
+    s3 = boto3.resource('s3')
+    s3.create_bucket(Bucket="test-bucket")
+    bodies = ['one', 'two', 'three']
+    put_chimes(s3, *bodies)
+    cache_manager = CacheManager(BucketName="test-bucket", CacheName="chimes")
+
+    def download(**kwargs):
+        if kwargs['key'] == 'chimes/file1':
+            raise IOError('connection reset')
+        open(kwargs['filename'], 'w').write(bodies[int(kwargs['key'][-1])])
+    with patch.object(boto3.s3.transfer.S3Transfer, "download_file") as m:
+        m.side_effect = download
+        with pytest.raises(IOError):
+            cache_manager.sync_remote_folder()
+    assert sorted(cache_manager.read_manifest().keys()) == \
+        ['chimes/file0', 'chimes/file2']
+    assert not [p for p in cache_folder.join('chimes').listdir()
+                if p.ext == '.tmp']
+    with patch.object(boto3.s3.transfer.S3Transfer, "download_file") as m:
+        m.side_effect = lambda **kwargs: \
+            open(kwargs['filename'], 'w').write('two')
+        cache_manager.sync_remote_folder()
+    assert [c[2]['key'] for c in m.mock_calls] == ['chimes/file1']
+    assert len(cache_manager.read_manifest()) == 3
+
+
 if __name__ == '__main__':
         unittest.main()
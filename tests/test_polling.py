@@ -0,0 +1,84 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import threading
+import time
+from mock import patch
+from messages.polling import IdleBackoff, PollStats, LONG_POLL_SECONDS, \
+    IDLE_BACKOFF_MAX_SECONDS
+
+
+@patch('messages.polling.threading.Event')
+def test_idle_backoff_doubles_up_to_maximum(mock_event):
+    backoff = IdleBackoff(Initial=1, Maximum=5)
+    backoff.idle()
+    rests = []
+    for _ in range(0, 5):
+        backoff.idle()
+        rests.append(mock_event.return_value.wait.call_args[0][0])
+    assert rests == [1, 2, 4, 5, 5]
+
+
+@patch('messages.polling.threading.Event')
+def test_idle_backoff_first_empty_receive_does_not_rest(mock_event):
+    backoff = IdleBackoff(Initial=1, Maximum=5)
+    assert backoff.idle() == 0
+    backoff.idle()
+    backoff.reset()
+    mock_event.return_value.wait.reset_mock()
+    assert backoff.idle() == 0
+    assert not mock_event.return_value.wait.called
+
+
+def test_wake_cuts_a_rest_short():
+    backoff = IdleBackoff(Initial=30, Maximum=30)
+    backoff.idle()
+    t = threading.Timer(0.1, backoff.wake)
+    t.start()
+    started = time.time()
+    backoff.idle()
+    assert time.time() - started < 5
+    assert backoff.delay == 0
+    t.join()
+
+
+def test_poll_stats_counts_receives():
+    stats = PollStats()
+    stats.received(0)
+    stats.received(3)
+    stats.rested(1.5)
+    stats.woken()
+    assert stats.as_dict() == {'receives': 2,
+                               'empty_receives': 1,
+                               'messages': 3,
+                               'idle_seconds': 1.5,
+                               'wakeups': 1}
+
+
+@patch('messages.polling.threading.Event')
+def test_idle_delivery_latency_stays_within_the_maximum_rest(mock_event):
+    # an hour of empty long polls at the default pacing; a message sent
+    # during a rest waits out the rest of it, one sent during a poll
+    # arrives at once
+    backoff = IdleBackoff()
+    rests = []
+    elapsed = 0
+    while elapsed < 3600:
+        mock_event.return_value.wait.reset_mock()
+        backoff.idle()
+        rest = mock_event.return_value.wait.call_args[0][0] \
+            if mock_event.return_value.wait.called else 0
+        rests.append(rest)
+        elapsed += LONG_POLL_SECONDS + rest
+    assert max(rests) == IDLE_BACKOFF_MAX_SECONDS
+    assert IDLE_BACKOFF_MAX_SECONDS <= LONG_POLL_SECONDS / 4
+    # the rests still keep an idle queue to a few receives a minute
+    assert len(rests) / 60.0 <= 3
@@ -0,0 +1,54 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import pytest
+from StringIO import StringIO
+from speaker.ring_buffer import RingBuffer
+
+
+def read_all(ring, n):
+    return b''.join(iter(lambda: ring.read(n), b''))
+
+
+def test_data_wraps_around_the_buffer():
+    ring = RingBuffer(8)
+    ring.write(b'abcdef')
+    assert ring.read(4) == b'abcd'
+    ring.write(b'ghijkl')
+    ring.close()
+    assert read_all(ring, 3) == b'efghijkl'
+
+
+def test_filling_blocks_until_the_reader_catches_up():
+    data = b''.join(chr(i % 256) for i in range(0, 10000))
+    ring = RingBuffer(64)
+    t = ring.start_filling(StringIO(data), chunk_size=50)
+    assert read_all(ring, 7) == data
+    t.join(1)
+    assert not t.is_alive()
+
+
+def test_stream_errors_reach_the_reader():
+    class BrokenStream(object):
+        def __init__(self):
+            self.reads = 0
+
+        def read(self, n):
+            self.reads += 1
+            if self.reads > 1:
+                raise IOError('connection reset')
+            return b'ab'
+
+    ring = RingBuffer(64)
+    ring.fill(BrokenStream())
+    assert ring.read(10) == b'ab'
+    with pytest.raises(IOError):
+        ring.read(10)
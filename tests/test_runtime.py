@@ -0,0 +1,78 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import pytest
+import threading
+from helpers.runtime import DeviceRuntime
+
+
+def test_task_failure_is_raised_to_the_caller():
+    runtime = DeviceRuntime()
+
+    def fail():
+        raise RuntimeError('no microphone')
+    runtime.spawn('listen', fail)
+    try:
+        with pytest.raises(RuntimeError):
+            for _ in range(0, 50):
+                runtime.wait(0.1)
+        assert runtime.stopping.is_set()
+    finally:
+        runtime.stop()
+
+
+def test_every_repeats_until_stopped():
+    runtime = DeviceRuntime()
+    calls = []
+    called_twice = threading.Event()
+
+    def sync():
+        calls.append(1)
+        if len(calls) == 2:
+            called_twice.set()
+    runtime.every('sync', 0.01, sync)
+    assert called_twice.wait(5)
+    runtime.stop()
+    count = len(calls)
+    assert not runtime.tasks['sync'].is_alive()
+    assert len(calls) == count
+
+
+def test_tasks_run_side_by_side():
+    runtime = DeviceRuntime()
+    first_started = threading.Event()
+    second_started = threading.Event()
+
+    def first():
+        first_started.set()
+        assert second_started.wait(5)
+
+    def second():
+        second_started.set()
+        assert first_started.wait(5)
+    runtime.spawn('first', first)
+    runtime.spawn('second', second)
+    assert first_started.wait(5) and second_started.wait(5)
+    runtime.stop()
+    runtime.check()
+
+
+def test_submit_runs_on_the_executor():
+    runtime = DeviceRuntime(ExecutorThreads=1)
+    try:
+        result = runtime.submit(lambda x, y: x + y, 1, y=2)
+        assert result.get(5) == 3
+        failed = runtime.submit(lambda: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            failed.get(5)
+        runtime.check()
+    finally:
+        runtime.stop()
@@ -0,0 +1,98 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import pytest
+from StringIO import StringIO
+from mock import MagicMock, patch
+from speaker.speaker import Speaker
+from speaker.audio_cache import AudioCache
+
+
+def polly_clients():
+    clients = MagicMock()
+    polly = clients.client.return_value
+    polly.synthesize_speech.side_effect = \
+        lambda **kw: {'AudioStream': StringIO(kw['Text'])}
+    return clients, polly
+
+
+def long_speech():
+    return '<speak>{}</speak>'.format(''.join(
+        '<p>{} {}</p>'.format(i, 'x' * 990) for i in range(0, 5)))
+
+
+def test_long_ssml_is_synthesized_in_chunks_in_order(tmpdir):
+    clients, polly = polly_clients()
+    s = Speaker(Clients=clients,
+                AudioCache=AudioCache(CacheFolder=str(tmpdir)))
+    s.generate_audio(Message=long_speech(), TextType='ssml')
+    paths = list(s.audio_parts)
+    assert len(paths) == len(s.chunks) > 1
+    assert [open(p).read() for p in paths] == s.chunks
+    assert polly.synthesize_speech.call_count == len(s.chunks)
+
+
+def test_chunks_are_cached_individually(tmpdir):
+    clients, polly = polly_clients()
+    cache = AudioCache(CacheFolder=str(tmpdir))
+    s = Speaker(Clients=clients, AudioCache=cache)
+    s.generate_audio(Message=long_speech(), TextType='ssml')
+    list(s.audio_parts)
+    s.cleanup()
+    calls = polly.synthesize_speech.call_count
+    s.generate_audio(Message=long_speech(), TextType='ssml')
+    list(s.audio_parts)
+    assert polly.synthesize_speech.call_count == calls
+    assert cache.hits == calls
+
+
+def read_ring(ring):
+    return b''.join(iter(lambda: ring.read(4096), b''))
+
+
+def test_streaming_feeds_each_chunk_through_a_ring_buffer():
+    clients, polly = polly_clients()
+    s = Speaker(Clients=clients, Streaming=True, UseAudioCache=False)
+    s.generate_audio(Message=long_speech(), TextType='ssml', VoiceId='Amy')
+    rings = list(s.open_pcm_streams())
+    assert [read_ring(r) for r in rings] == s.chunks
+    kwargs = polly.synthesize_speech.call_args[1]
+    assert kwargs['OutputFormat'] == 'pcm'
+    assert kwargs['SampleRate'] == '16000'
+    assert kwargs['TextType'] == 'ssml'
+    assert kwargs['VoiceId'] == 'Amy'
+
+
+@patch('speaker.speaker.get_audio_engine')
+def test_streaming_speech_is_played_as_pcm(mock_engine):
+    clients, polly = polly_clients()
+    engine = mock_engine.return_value
+    engine.play_pcm.return_value.error = None
+    s = Speaker(Clients=clients, Streaming=True, UseAudioCache=False)
+    s.generate_audio(Message='hello there', TextType='text')
+    s.speak(IncludeChime=True)
+    args, kwargs = engine.play_pcm.call_args
+    assert [read_ring(r) for r in args[0]] == ['hello there']
+    assert args[1] == 16000
+    assert kwargs['Chime'] == 'three_tone_chime'
+    assert engine.play_pcm.return_value.wait.called
+    assert not engine.play_file.called
+
+
+@patch('speaker.speaker.get_audio_engine')
+def test_streaming_errors_are_raised_after_playback(mock_engine):
+    clients, polly = polly_clients()
+    engine = mock_engine.return_value
+    engine.play_pcm.return_value.error = IOError('connection reset')
+    s = Speaker(Clients=clients, Streaming=True, UseAudioCache=False)
+    s.generate_audio(Message='hello there', TextType='text')
+    with pytest.raises(IOError):
+        s.speak()
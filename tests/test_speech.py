@@ -0,0 +1,133 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import re
+from mock import patch
+from helpers.speech import split_ssml, SpeechHelper, compile_template, \
+    register_token, unregister_token
+
+
+def test_short_speech_is_left_alone():
+    ssml = '<speak><p>Brush your teeth</p></speak>'
+    assert split_ssml(ssml) == [ssml]
+
+
+def test_speech_is_split_between_paragraphs():
+    paragraphs = ['<p>Reminder number {}</p>'.format(i) for i in range(0, 20)]
+    ssml = '<speak>{}</speak>'.format(''.join(paragraphs))
+    chunks = split_ssml(ssml, max_chars=100)
+    assert len(chunks) > 1
+    assert all(len(c) <= 100 for c in chunks)
+    assert all(c.startswith('<speak><p>') and c.endswith('</p></speak>')
+               for c in chunks)
+    assert ''.join(c[len('<speak>'):-len('</speak>')] for c in chunks) == \
+        ''.join(paragraphs)
+
+
+def test_long_paragraph_is_split_between_words_not_tags():
+    body = ' '.join(['word <break time="1s"/>'] * 30)
+    chunks = split_ssml('<speak><p>{}</p></speak>'.format(body),
+                        max_chars=80)
+    assert all(len(c) <= 80 for c in chunks)
+    words = []
+    for c in chunks:
+        assert c.startswith('<speak><p>') and c.endswith('</p></speak>')
+        words.append(c[len('<speak><p>'):-len('</p></speak>')])
+    assert ' '.join(words) == body
+
+
+def test_text_outside_paragraphs_is_kept_in_order():
+    paragraphs = ''.join('<p>Reminder number {}</p>'.format(i)
+                         for i in range(0, 10))
+    ssml = '<speak>Hello there.{}Bye.</speak>'.format(paragraphs)
+    chunks = split_ssml(ssml, max_chars=100)
+    assert len(chunks) > 1
+    assert all(len(c) <= 100 for c in chunks)
+    assert chunks[0].startswith('<speak>Hello there.<p>')
+    assert chunks[-1].endswith('</p>Bye.</speak>')
+    assert ''.join(c[len('<speak>'):-len('</speak>')] for c in chunks) == \
+        'Hello there.{}Bye.'.format(paragraphs)
+
+
+def test_long_text_outside_paragraphs_is_split_between_words():
+    text = ' '.join(['word'] * 60)
+    ssml = '<speak>{}<p>Bye.</p></speak>'.format(text)
+    chunks = split_ssml(ssml, max_chars=80)
+    assert all(len(c) <= 80 for c in chunks)
+    bodies = [c[len('<speak>'):-len('</speak>')] for c in chunks]
+    assert bodies[-1].endswith('word<p>Bye.</p>')
+    bodies[-1] = bodies[-1][:-len('<p>Bye.</p>')]
+    assert ' '.join(bodies) == text
+
+
+def test_nested_markup_is_never_split_inside_an_element():
+    slow = '<prosody rate="slow">take your time</prosody>'
+    digits = '<s>a <say-as interpret-as="digits">123</say-as></s>'
+    body = ' '.join(['now', slow, '<emphasis>really <break/> do</emphasis>',
+                     digits] * 8)
+    chunks = split_ssml('<speak><p>{}</p></speak>'.format(body),
+                        max_chars=120)
+    assert len(chunks) > 1
+    assert all(len(c) <= 120 for c in chunks)
+    pieces = []
+    for c in chunks:
+        assert c.startswith('<speak><p>') and c.endswith('</p></speak>')
+        inner = c[len('<speak><p>'):-len('</p></speak>')]
+        for tag in ['prosody', 'emphasis', 's', 'say-as']:
+            assert len(re.findall(r'<%s[ >]' % tag, inner)) == \
+                inner.count('</%s>' % tag)
+        pieces.append(inner)
+    assert ' '.join(pieces) == body
+
+
+def test_paragraph_attributes_are_kept_when_split():
+    body = ' '.join(['word'] * 40)
+    chunks = split_ssml('<speak><p xml:lang="en-GB">{}</p></speak>'
+                        .format(body), max_chars=80)
+    assert len(chunks) > 1
+    assert all(c.startswith('<speak><p xml:lang="en-GB">') for c in chunks)
+
+
+def test_tokens_are_replaced():
+    sh = SpeechHelper(PersonName='calvin')
+    with patch.object(sh, 'greeting', return_value='Good morning, calvin.'):
+        assert sh.replace_tokens('{greeting} {person}, brush your teeth') \
+            == 'Good morning, calvin. calvin, brush your teeth'
+
+
+def test_only_tokens_in_the_message_are_worked_out():
+    sh = SpeechHelper(PersonName='calvin')
+    with patch.object(sh, 'greeting') as greeting, \
+            patch.object(sh, 'time_and_date') as time_and_date, \
+            patch('helpers.speech.Weather') as weather:
+        assert sh.replace_tokens('Hi {person}') == 'Hi calvin'
+    assert not greeting.called
+    assert not time_and_date.called
+    assert not weather.called
+
+
+def test_unknown_tokens_are_left_alone():
+    sh = SpeechHelper(PersonName='calvin')
+    assert sh.replace_tokens('{nothing} to {see}') == '{nothing} to {see}'
+
+
+def test_templates_are_compiled_once():
+    assert compile_template('Hi {person}') is compile_template('Hi {person}')
+
+
+def test_registered_tokens_are_available():
+    register_token('bedtime', lambda h: '8 PM')
+    try:
+        sh = SpeechHelper(PersonName='calvin')
+        assert sh.replace_tokens('Bed at {bedtime}') == 'Bed at 8 PM'
+    finally:
+        unregister_token('bedtime')
+    assert sh.replace_tokens('Bed at {bedtime}') == 'Bed at {bedtime}'
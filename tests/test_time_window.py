@@ -0,0 +1,82 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import arrow
+from time_window import TimeWindow, TimeWindowSet
+from person.person import Person
+from locator.locator import LocationAvailability
+
+ical_event_night = """
+BEGIN:VEVENT
+DTSTART;TZID=EST;VALUE=DATE-TIME:20131122T221200
+DURATION:PT6H
+RRULE:FREQ=DAILY
+END:VEVENT
+"""
+
+ical_event = """
+BEGIN:VEVENT
+DTSTART;TZID=EST;VALUE=DATE-TIME:20131122T071200
+DURATION:PT6H
+RRULE:FREQ=DAILY
+END:VEVENT
+"""
+
+
+def indexed_window_set():
+    ws = TimeWindowSet(IntervalIndex=True)
+    ws.add_time_window(TimeWindow(ical=ical_event, Priority=100))
+    ws.add_time_window(TimeWindow(ical=ical_event_night, Priority=200))
+    ws.add_time_window(TimeWindow(ical=ical_event_night, IsMuted=True))
+    return ws
+
+
+def test_interval_index_matches_window_checks():
+    ws = indexed_window_set()
+    ws.set_list[2].is_muted = False
+    start = arrow.get('2014-01-01T00:00:00.000-05:00')
+    for minutes in range(0, 48 * 60, 17):
+        dt = start.replace(minutes=minutes)
+        expected = [tw for tw in ws.set_list if tw.is_in_window(dt)]
+        assert list(ws.all_available(dt)) == expected
+
+
+def test_interval_index_respects_muted_windows():
+    ws = indexed_window_set()
+    assert ws.is_available(arrow.get('2014-01-01T09:09:00.000-05:00'))
+    assert not ws.is_available(arrow.get('2014-01-01T23:09:00.000-05:00'))
+    assert not ws.is_available(arrow.get('2014-01-01T06:09:00.000-05:00'))
+
+
+def test_interval_index_rebuilds_when_windows_change():
+    ws = indexed_window_set()
+    dt = arrow.get('2014-01-01T09:09:00.000-05:00')
+    assert len(list(ws.all_available(dt))) == 1
+    ws.add_time_window(TimeWindow(ical=ical_event))
+    assert len(list(ws.all_available(dt))) == 2
+    ws.set_list[0].is_muted = True
+    assert not ws.is_available(dt)
+
+
+def test_interval_index_rebuilds_past_the_horizon():
+    ws = indexed_window_set()
+    dt = arrow.get('2014-01-01T09:09:00.000-05:00')
+    assert ws.is_available(dt)
+    index = ws._unmuted_index
+    assert ws.is_available(dt.replace(days=1))
+    assert ws._unmuted_index is index
+    assert ws.is_available(dt.replace(days=3))
+    assert ws._unmuted_index is not index
+
+
+def test_people_and_locations_use_the_interval_index():
+    assert Person(Name='calvin').time_windows.use_index
+    assert LocationAvailability(LocationName='kitchen').time_windows.use_index
@@ -0,0 +1,79 @@
+# Copyright 2017 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Licensed under the Amazon Software License (the "License"). You may not
+# use this file except in compliance with the License. A copy of the
+# License is located at:
+#    http://aws.amazon.com/asl/
+# or in the "license" file accompanying this file. This file is distributed
+# on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, expressi
+# or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+
+import time
+import pytest
+from mock import patch
+from helpers.weather import Weather, WeatherProvider
+
+
+class StubFetch(object):
+    def __init__(self):
+        self.urls = []
+        self.fail = False
+
+    def __call__(self, url):
+        self.urls.append(url)
+        if self.fail:
+            raise IOError('upstream is down')
+        if '/forecast/' in url:
+            return {'forecast': {'simpleforecast': {'forecastday': [{
+                'high': {'fahrenheit': '75'},
+                'low': {'fahrenheit': '55'},
+                'conditions': 'sunny'}]}}}
+        return {'current_observation': {'weather': 'clear', 'temp_f': 65}}
+
+
+def weather(provider):
+    with patch('helpers.weather.get_config', return_value={
+            'wunderground_api_key': 'key',
+            'weather_state': 'GA',
+            'weather_city': 'Buford'}):
+        return Weather(Provider=provider)
+
+
+def test_describe_is_served_from_the_cache():
+    fetch = StubFetch()
+    provider = WeatherProvider(Fetch=fetch)
+    first = weather(provider).describe()
+    assert weather(provider).describe() == first
+    assert 'sunny' in first
+    assert len(fetch.urls) == 2
+
+
+def test_expired_entries_are_fetched_again():
+    fetch = StubFetch()
+    provider = WeatherProvider(Fetch=fetch, TtlSeconds=0)
+    provider.get('key', 'conditions', 'GA', 'Buford')
+    provider.get('key', 'conditions', 'GA', 'Buford')
+    assert len(fetch.urls) == 2
+
+
+def test_stale_data_is_used_when_upstream_fails():
+    fetch = StubFetch()
+    provider = WeatherProvider(Fetch=fetch, TtlSeconds=0)
+    data = provider.get('key', 'conditions', 'GA', 'Buford')
+    fetch.fail = True
+    assert provider.get('key', 'conditions', 'GA', 'Buford') == data
+    with pytest.raises(IOError):
+        provider.get('key', 'conditions', 'GA', 'Atlanta')
+
+
+def test_entries_are_refreshed_in_the_background_before_expiry():
+    fetch = StubFetch()
+    provider = WeatherProvider(Fetch=fetch, TtlSeconds=60,
+                               RefreshAheadSeconds=60)
+    provider.get('key', 'conditions', 'GA', 'Buford')
+    provider.get('key', 'conditions', 'GA', 'Buford')
+    deadline = time.time() + 5
+    while len(fetch.urls) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(fetch.urls) == 2
@@ -11,35 +11,93 @@
 
 from icalendar import Calendar
 from dateutil.rrule import rrulestr
+from datetime import timedelta
+from bisect import bisect_left
 import arrow
 import json
 from helpers.datetime_helpers import check_if_timezone_naive
 
 LOCATION_TABLE = 'locations'
+DEFAULT_INDEX_HORIZON = timedelta(hours=48)
 
 
 def display(cal):
     return cal.to_ical().replace('\r\n', '\n').strip()
 
 
+def as_datetime(dt):
+    return getattr(dt, 'datetime', dt)
+
+
+class IntervalIndex(object):
+    """every occurrence of a list of windows between two times, sorted by
+    start so a lookup is a binary search"""
+    def __init__(self, windows, start, end):
+        self.start = start
+        self.end = end
+        self.max_delta = max([tw.delta for _, tw in windows] or
+                             [timedelta(0)])
+        intervals = []
+        for pos, tw in windows:
+            for s in tw.rule.between(start - tw.delta, end, inc=True):
+                intervals.append((s, s + tw.delta, pos, tw))
+        intervals.sort(key=lambda i: i[0])
+        self.intervals = intervals
+        self.starts = [i[0] for i in intervals]
+
+    def covers(self, dt):
+        return self.start <= dt < self.end
+
+    def windows_at(self, dt):
+        """the windows open at dt, in the order they were given"""
+        found = {}
+        i = bisect_left(self.starts, dt)
+        earliest = dt - self.max_delta
+        while i > 0 and self.starts[i - 1] > earliest:
+            i -= 1
+            s, e, pos, tw = self.intervals[i]
+            if dt < e:
+                found[pos] = tw
+        return [found[k] for k in sorted(found)]
+
+
 class TimeWindowSet(object):
-    def __init__(self):
+    def __init__(self, **kwargs):
         self.set_list = []
+        self.use_index = kwargs.get('IntervalIndex', False)
+        self.horizon = kwargs.get('Horizon', DEFAULT_INDEX_HORIZON)
+        self._index_key = None
+        self._unmuted_index = None
+        self._muted_index = None
 
     def add_time_window(self, tw):
         self.set_list.append(tw)
 
+    def _indexes(self, dt):
+        key = [(id(tw), tw.is_muted) for tw in self.set_list]
+        if key != self._index_key or not self._unmuted_index.covers(dt):
+            windows = list(enumerate(self.set_list))
+            self._unmuted_index = IntervalIndex(
+                [(p, tw) for p, tw in windows if not tw.is_muted],
+                dt, dt + self.horizon)
+            self._muted_index = IntervalIndex(
+                [(p, tw) for p, tw in windows if tw.is_muted],
+                dt, dt + self.horizon)
+            self._index_key = key
+        return self._unmuted_index, self._muted_index
+
     def is_available(self, dt):
+        if self.use_index:
+            dt = as_datetime(dt)
+            unmuted, muted = self._indexes(dt)
+            if muted.windows_at(dt):
+                return False
+            return len(unmuted.windows_at(dt)) > 0
         is_avail = False
-        print "Checking if window is current with " + dt.isoformat()
         for tw in self.set_list:
-            print 'is it muted? ' + str(tw.is_muted)
-            print "is in window " + str(tw.is_in_window(dt))
-            if tw.is_muted and tw.is_in_window(dt):
-                print "NOT AVAILABLE"
-                return False
             if tw.is_in_window(dt):
-                print "AVAILABLE"
+                if tw.is_muted:
+                    return False
                 is_avail = True
         return is_avail
 
@@ -57,6 +115,12 @@ class TimeWindowSet(object):
     def all_available(self, dt=None):
         if not dt:
             dt = arrow.utcnow()
+        if self.use_index:
+            dt = as_datetime(dt)
+            unmuted, _ = self._indexes(dt)
+            for tw in unmuted.windows_at(dt):
+                yield tw
+            return
         for tw in self.set_list:
             if not tw.is_muted and tw.is_in_window(dt):
                 yield tw
@@ -91,7 +155,8 @@ class TimeWindow(object):
     def is_in_window(self, dt=None):
         if not dt:
             dt = arrow.utcnow()
-        return self.previous_start(dt) < dt < self.previous_end(dt)
+        start = self.previous_start(dt)
+        return start < dt < start + self.delta
 
     def to_json(self):
         return {'ical': self.ical,